@@ -0,0 +1,108 @@
+"""
+CPU and bytes on the wire of always-on compression versus CompressionPolicy, for representative StreamUpdate payloads:
+
+    python -m src.benchmark.compression_benchmark --messages 2000
+
+Compression is replayed with zlib the way grpc core applies it to each message, deflate and gzip at the default level,
+falling back to the uncompressed message when compressing does not shrink it. The CPU column includes the policy's
+own size checks and sampling.
+"""
+import argparse
+import math
+import os
+import time
+import zlib
+
+import grpc
+
+import social_media_stream_pb2
+from src.utils.compression import CompressionPolicy
+
+METHOD = '/SocialMediaStreamService/startStream'
+# grpc's length-prefixed message framing
+FRAME_HEADER_BYTES = 5
+
+
+def _encoded_av(payload_size: int):
+    # codec output looks like random bytes to zlib
+    return social_media_stream_pb2.StreamUpdate(
+        video_frame=social_media_stream_pb2.VideoFrame(frame_data=os.urandom(payload_size)),
+        audio_chunk=social_media_stream_pb2.AudioChunk(audio_data=os.urandom(payload_size // 16)))
+
+
+def _raw_pcm(payload_size: int):
+    # uncompressed 16-bit mono audio of a 440 Hz tone at 48 kHz
+    samples = (int(12_000 * math.sin(2 * math.pi * 440 * i / 48_000)) for i in range(payload_size // 2))
+    audio = b''.join(sample.to_bytes(2, 'little', signed=True) for sample in samples)
+    return social_media_stream_pb2.StreamUpdate(audio_chunk=social_media_stream_pb2.AudioChunk(audio_data=audio))
+
+
+def _control(_payload_size: int):
+    return social_media_stream_pb2.StreamUpdate(
+        video_frame=social_media_stream_pb2.VideoFrame(frame_data=b'video_frame_data0'),
+        audio_chunk=social_media_stream_pb2.AudioChunk(audio_data=b'audio_data0'))
+
+
+WORKLOADS = {'encoded-av': _encoded_av, 'raw-pcm': _raw_pcm, 'control': _control}
+
+
+def _always(compression: grpc.Compression):
+    return lambda message: compression
+
+
+def _adaptive():
+    policy = CompressionPolicy(grpc.Compression.Deflate)
+    return lambda message: policy.choose(METHOD, message)
+
+
+# each run gets a fresh strategy, so the adaptive one starts without samples
+STRATEGIES = {
+    'none': lambda: _always(grpc.Compression.NoCompression),
+    'gzip': lambda: _always(grpc.Compression.Gzip),
+    'deflate': lambda: _always(grpc.Compression.Deflate),
+    'adaptive': _adaptive,
+}
+
+
+def _compress(serialized: bytes, compression: grpc.Compression) -> int:
+    if compression == grpc.Compression.NoCompression:
+        return len(serialized)
+    wbits = 31 if compression == grpc.Compression.Gzip else 15
+    compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, wbits)
+    compressed = compressor.compress(serialized) + compressor.flush()
+    return min(len(compressed), len(serialized))
+
+
+def run(messages, choose):
+    """
+    :param choose: returns the compression of a message
+    :return: CPU seconds, bytes on the wire
+    """
+    wire_bytes = 0
+    started = time.process_time()
+    for message, serialized in messages:
+        wire_bytes += FRAME_HEADER_BYTES + _compress(serialized, choose(message))
+    return time.process_time() - started, wire_bytes
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compression policy benchmark on StreamUpdate payloads')
+    parser.add_argument('--messages', type=int, default=1000, help='messages per workload')
+    parser.add_argument('--payload-size', type=int, default=16 * 1024, help='bytes of video, or of audio for raw-pcm')
+    args = parser.parse_args()
+
+    print(f'{"workload":<12} {"strategy":<10} {"CPU ms":>9} {"MiB sent":>10} {"saved":>7}')
+    for workload, create in WORKLOADS.items():
+        # a handful of distinct messages repeated, building messages is not what is measured
+        distinct = [create(args.payload_size) for _ in range(16)]
+        messages = [(message, message.SerializeToString()) for message in distinct] * (args.messages // 16 + 1)
+        messages = messages[:args.messages]
+        _, uncompressed = run(messages, STRATEGIES['none']())
+        for strategy, create_choose in STRATEGIES.items():
+            cpu_s, wire_bytes = run(messages, create_choose())
+            print(f'{workload:<12} {strategy:<10} {cpu_s * 1000:>9.1f} {wire_bytes / 2 ** 20:>10.2f} '
+                  f'{1 - wire_bytes / uncompressed:>7.1%}')
+
+
+if __name__ == '__main__':
+    main()
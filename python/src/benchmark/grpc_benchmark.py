@@ -0,0 +1,206 @@
+"""
+Load generator for the four RPC types of SocialMediaStreamService, run against an in-process GrpcCrashingServer:
+
+    python -m src.benchmark.grpc_benchmark --rpc all --concurrency 16 --duration 10 --failure-rate 0.1 --compare
+"""
+import argparse
+import logging as log
+import os
+import threading
+import time
+from concurrent import futures
+
+import grpc
+
+import social_media_stream_pb2
+import social_media_stream_pb2_grpc as grpc_stubs
+from src.benchmark.latency_histogram import LatencyHistogram
+from src.client.grpc_stream_batcher import batched_updates
+from src.interceptor.grpc_client_auth_interceptor import AuthInterceptor
+from src.interceptor.grpc_client_circuit_breaker import CircuitBreakerClientInterceptor
+from src.interceptor.grpc_client_retry_handler import RetryOnRpcErrorClientInterceptor, ExponentialBackoff, RetryBudget
+from src.interceptor.grpc_server_auth_interceptor import GrpcAuthServerInterceptor
+from src.interceptor.grpc_server_concurrency_limiter import AdaptiveConcurrencyServerInterceptor
+from src.interceptor.grpc_server_fault_injection import FaultInjectionServerInterceptor, FaultInjector
+from src.server.grpc_broadcast_hub import BroadcastHubRegistry
+from src.server.grpc_crashing_server import GrpcCrashingServer, create_server_credentials
+from src.server.grpc_response_cache import ResponseCache
+from src.server.grpc_service_handlers import add_servicer_to_server
+from src.utils import credentials
+
+RPC_TYPES = ('unary', 'server-stream', 'client-stream', 'bidi')
+STATUS_FOR_RETRY = [grpc.StatusCode.CANCELLED, grpc.StatusCode.UNAVAILABLE, grpc.StatusCode.DEADLINE_EXCEEDED]
+
+
+class _UncachedResponses:
+    # every downloadStream call runs the handler, so unary numbers measure the RPC path and not cache hits
+
+    @staticmethod
+    def get_or_load(key, load):
+        return load()
+
+
+def start_server(*, tls: bool, faults: FaultInjector, workers: int, response_cache: bool = False):
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=workers),
+                         interceptors=[AdaptiveConcurrencyServerInterceptor(), GrpcAuthServerInterceptor(),
+                                       FaultInjectionServerInterceptor(faults)])
+    # frames are published as fast as viewers take them, the benchmark measures the RPC path and not the frame rate
+    servicer = GrpcCrashingServer(broadcasts=BroadcastHubRegistry(frame_interval_s=0.001),
+                                  response_cache=ResponseCache() if response_cache else _UncachedResponses())
+    add_servicer_to_server(servicer, server)
+    if tls:
+        port = server.add_secure_port('localhost:0', create_server_credentials())
+    else:
+        port = server.add_insecure_port('localhost:0')
+    server.start()
+    return server, port
+
+
+def create_channel(port: int, *, tls: bool, resilient: bool) -> grpc.Channel:
+    if tls:
+        composite_credentials = grpc.composite_channel_credentials(
+            grpc.ssl_channel_credentials(credentials.SERVER_CERTIFICATE),
+            grpc.metadata_call_credentials(AuthInterceptor(), name="auth gateway"),
+        )
+        channel = grpc.secure_channel(f'localhost:{port}', composite_credentials)
+    else:
+        channel = grpc.insecure_channel(f'localhost:{port}')
+    if not resilient:
+        return channel
+    # same settings as GrpcResilientClient
+    return grpc.intercept_channel(
+        channel,
+        RetryOnRpcErrorClientInterceptor(
+            max_attempts=3, sleeping_policy=ExponentialBackoff(init_backoff_ms=500, max_backoff_ms=5_000, multiplier=2),
+            status_for_retry=STATUS_FOR_RETRY, retry_budget=RetryBudget(max_tokens=10, token_ratio=0.1)),
+        CircuitBreakerClientInterceptor(failure_threshold=3, recovery_timeout=5, status_for_retry=STATUS_FOR_RETRY)
+    )
+
+
+def _stream_updates(payload: bytes, messages: int):
+    for _ in range(messages):
+        yield social_media_stream_pb2.StreamUpdate(video_frame=social_media_stream_pb2.VideoFrame(frame_data=payload),
+                                                   audio_chunk=social_media_stream_pb2.AudioChunk(audio_data=payload))
+
+
+def _interact_stream_updates(payload: bytes, messages: int):
+    yield social_media_stream_pb2.InteractStreamUpdate(provider_name='Benchmark',
+                                                       audio_chunk=social_media_stream_pb2.AudioChunk(audio_data=b'Hey'))
+    for _ in range(messages):
+        yield social_media_stream_pb2.InteractStreamUpdate(provider_name='Benchmark',
+                                                           video_frame=social_media_stream_pb2.VideoFrame(frame_data=payload),
+                                                           audio_chunk=social_media_stream_pb2.AudioChunk(audio_data=payload))
+
+
+def _batched(updates, create_batch, batch_delay_s):
+    if batch_delay_s is None:
+        return updates
+    return batched_updates(updates, create_batch, max_delay_s=batch_delay_s)
+
+
+def _call(stub, rpc: str, payload: bytes, messages: int, timeout: float, batch_delay_s: float):
+    request = social_media_stream_pb2.WatchStreamRequest(provider_name='benchmark', quality='4k')
+    if rpc == 'unary':
+        stub.downloadStream(request, timeout=timeout)
+    elif rpc == 'server-stream':
+        for _ in stub.watchStream(request, timeout=timeout):
+            pass
+    elif rpc == 'client-stream':
+        updates = _batched(_stream_updates(payload, messages),
+                           lambda batch: social_media_stream_pb2.StreamUpdate(batched_updates=batch), batch_delay_s)
+        stub.startStream(updates, timeout=timeout)
+    else:
+        updates = _batched(_interact_stream_updates(payload, messages),
+                           lambda batch: social_media_stream_pb2.InteractStreamUpdate(batched_updates=batch), batch_delay_s)
+        for _ in stub.joinInteractStream(updates, timeout=timeout):
+            pass
+
+
+def run(stub, rpc: str, *, concurrency: int, duration_s: float, payload: bytes, messages: int, timeout: float,
+        batch_delay_s: float = None):
+    """
+    Closed loop: `concurrency` threads issue calls back to back for `duration_s` seconds.
+    :return: latency histogram of successful calls in microseconds, number of failed calls, elapsed seconds
+    """
+    histograms = [LatencyHistogram() for _ in range(concurrency)]
+    errors = [0] * concurrency
+    deadline = time.perf_counter() + duration_s
+
+    def worker(i):
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            try:
+                _call(stub, rpc, payload, messages, timeout, batch_delay_s)
+            except grpc.RpcError:
+                errors[i] += 1
+                continue
+            histograms[i].record((time.perf_counter() - started) * 1_000_000)
+
+    started = time.perf_counter()
+    workers = [threading.Thread(target=worker, args=(i,)) for i in range(concurrency)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    histogram = LatencyHistogram()
+    for worker_histogram in histograms:
+        histogram.merge(worker_histogram)
+    return histogram, sum(errors), elapsed
+
+
+def _report(label: str, rpc: str, histogram: LatencyHistogram, errors: int, elapsed: float):
+    print(f'{label:<10} {rpc:<14} {histogram.count:>8} {errors:>7} {histogram.count / elapsed:>10.1f} '
+          f'{histogram.percentile(50) / 1000:>9.2f} {histogram.percentile(99) / 1000:>9.2f} '
+          f'{histogram.percentile(99.9) / 1000:>9.2f} {histogram.max / 1000:>9.2f}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Throughput and latency benchmark of SocialMediaStreamService')
+    parser.add_argument('--rpc', choices=RPC_TYPES + ('all',), default='all')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=5, help='seconds per RPC type and configuration')
+    parser.add_argument('--payload-size', type=int, default=1024, help='bytes of audio and of video per streamed message')
+    parser.add_argument('--messages', type=int, default=10, help='messages sent per client or bidirectional stream')
+    parser.add_argument('--timeout', type=float, default=5)
+    parser.add_argument('--failure-rate', type=float, default=0.0, help='share of calls the server fails right away')
+    parser.add_argument('--fault-config', help='fault injection config file, replaces --failure-rate')
+    parser.add_argument('--seed', type=int, help='seed of the --failure-rate faults, for repeatable runs')
+    parser.add_argument('--response-cache', action='store_true', help='serve downloadStream from the response cache')
+    parser.add_argument('--batch-ms', type=float, help='coalesce streamed messages into batches flushed at least this often')
+    parser.add_argument('--no-tls', dest='tls', action='store_false', help='plaintext channel without JWT call credentials')
+    parser.add_argument('--compare', action='store_true',
+                        help='run every RPC type with and without the retry and circuit breaker interceptors')
+    args = parser.parse_args()
+
+    # failed calls are expected here, keep the server from logging a stack trace for each of them
+    log.getLogger('grpc._server').setLevel(log.CRITICAL)
+    if args.fault_config:
+        faults = FaultInjector.from_file(args.fault_config)
+    else:
+        faults = FaultInjector.from_failure_rate(args.failure_rate, seed=args.seed)
+    server, port = start_server(tls=args.tls, faults=faults, workers=args.concurrency * 2 + 4,
+                                response_cache=args.response_cache)
+    payload = os.urandom(args.payload_size)
+    configurations = [('plain', False), ('resilient', True)] if args.compare else [('resilient', True)]
+    rpcs = RPC_TYPES if args.rpc == 'all' else (args.rpc,)
+
+    print(f'{"config":<10} {"rpc":<14} {"calls":>8} {"errors":>7} {"qps":>10} '
+          f'{"p50 ms":>9} {"p99 ms":>9} {"p999 ms":>9} {"max ms":>9}')
+    try:
+        for label, resilient in configurations:
+            channel = create_channel(port, tls=args.tls, resilient=resilient)
+            stub = grpc_stubs.SocialMediaStreamServiceStub(channel)
+            for rpc in rpcs:
+                histogram, errors, elapsed = run(stub, rpc, concurrency=args.concurrency, duration_s=args.duration,
+                                                 payload=payload, messages=args.messages, timeout=args.timeout,
+                                                 batch_delay_s=args.batch_ms / 1000 if args.batch_ms else None)
+                _report(label, rpc, histogram, errors, elapsed)
+            channel.close()
+    finally:
+        server.stop(None)
+
+
+if __name__ == '__main__':
+    main()
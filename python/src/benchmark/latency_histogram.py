@@ -0,0 +1,49 @@
+from collections import Counter
+
+
+class LatencyHistogram:
+    """
+    HDR-style histogram: values are bucketed log-linearly, `significant_bits` of every value are kept,
+    so any percentile is reported within 2^-(significant_bits - 1) relative error at a fixed memory cost.
+    """
+
+    def __init__(self, significant_bits: int = 7):
+        self._significant_bits = significant_bits
+        self._buckets = Counter()
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = 0
+
+    def record(self, value: int):
+        value = max(int(value), 0)
+        shift = max(value.bit_length() - self._significant_bits, 0)
+        self._buckets[(shift, value >> shift)] += 1
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = max(self.max, value)
+
+    def merge(self, other: 'LatencyHistogram'):
+        self._buckets.update(other._buckets)
+        self.count += other.count
+        self.total += other.total
+        if other.min is not None:
+            self.min = other.min if self.min is None else min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    def percentile(self, percentile: float) -> int:
+        if not self.count:
+            return 0
+        rank = max(percentile / 100 * self.count, 1)
+        seen = 0
+        for shift, mantissa in sorted(self._buckets, key=lambda bucket: bucket[1] << bucket[0]):
+            seen += self._buckets[(shift, mantissa)]
+            if seen >= rank:
+                # report the upper edge of the bucket, never below the recorded maximum's bucket
+                return min(((mantissa + 1) << shift) - 1, self.max)
+        return self.max
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0
@@ -0,0 +1,176 @@
+import os
+import random
+import socket
+import threading
+from typing import Callable, List, Optional
+
+import grpc
+
+from src.interceptor.grpc_client_circuit_breaker import CircuitBreakerClientInterceptor
+
+
+def resolve_targets(host: str, port) -> List[str]:
+    """
+    Explicit SERVER_TARGETS (comma separated host:port list) wins, otherwise every address the host resolves to
+    becomes a target. Use a headless service in k8s so that the host resolves to the pod IPs.
+    """
+    explicit_targets = os.environ.get('SERVER_TARGETS')
+    if explicit_targets:
+        return [target.strip() for target in explicit_targets.split(',') if target.strip()]
+    try:
+        infos = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+    except socket.gaierror:
+        return [f'{host}:{port}']
+    # the servers listen on 0.0.0.0, so IPv6 addresses are only dialled when the host has no IPv4 ones
+    addresses = sorted({info[4][0] for info in infos if info[0] == socket.AF_INET}) \
+        or sorted({info[4][0] for info in infos})
+    return [f'[{address}]:{port}' if ':' in address else f'{address}:{port}' for address in addresses]
+
+
+class _Target:
+
+    def __init__(self, address: str, raw_channel: grpc.Channel, channel: grpc.Channel,
+                 breaker: CircuitBreakerClientInterceptor):
+        self.address = address
+        self.raw_channel = raw_channel
+        self.channel = channel
+        self.breaker = breaker
+        self.outstanding = 0
+
+
+class _BalancedMultiCallable:
+    # every invocation, so every retry and hedge of a call, goes to the target picked at that moment
+
+    def __init__(self, pool: 'GrpcChannelPool', create_multi_callable: Callable[[grpc.Channel], object],
+                 response_streaming: bool):
+        self._pool = pool
+        self._multi_callables = {target.address: create_multi_callable(target.channel) for target in pool.targets}
+        self._response_streaming = response_streaming
+
+    def _start(self):
+        target = self._pool.pick()
+        self._pool.begin(target)
+        return target, self._multi_callables[target.address]
+
+    def __call__(self, request_or_iterator, *args, **kwargs):
+        if self._response_streaming:
+            return self._stream(request_or_iterator, args, kwargs)
+        target, multi_callable = self._start()
+        try:
+            return multi_callable(request_or_iterator, *args, **kwargs)
+        finally:
+            self._pool.end(target)
+
+    def _stream(self, request_or_iterator, args, kwargs):
+        # the circuit breakers hand out plain iterators, a stream is outstanding until it has been consumed
+        target, multi_callable = self._start()
+        try:
+            yield from multi_callable(request_or_iterator, *args, **kwargs)
+        finally:
+            self._pool.end(target)
+
+    def with_call(self, request_or_iterator, *args, **kwargs):
+        target, multi_callable = self._start()
+        try:
+            return multi_callable.with_call(request_or_iterator, *args, **kwargs)
+        finally:
+            self._pool.end(target)
+
+    def future(self, request_or_iterator, *args, **kwargs):
+        target, multi_callable = self._start()
+        try:
+            future = multi_callable.future(request_or_iterator, *args, **kwargs)
+        except BaseException:
+            self._pool.end(target)
+            raise
+        future.add_done_callback(lambda _: self._pool.end(target))
+        return future
+
+
+class _BalancedChannel(grpc.Channel):
+    # arguments only some grpcio versions know, such as _registered_method, are passed on as given
+
+    def __init__(self, pool: 'GrpcChannelPool'):
+        self._pool = pool
+
+    def subscribe(self, callback, try_to_connect=False):
+        raise NotImplementedError('Subscribe to the channel of a target instead')
+
+    def unsubscribe(self, callback):
+        raise NotImplementedError('Subscribe to the channel of a target instead')
+
+    def unary_unary(self, method, request_serializer=None, response_deserializer=None, *args, **kwargs):
+        return _BalancedMultiCallable(self._pool, lambda channel: channel.unary_unary(
+            method, request_serializer, response_deserializer, *args, **kwargs), response_streaming=False)
+
+    def unary_stream(self, method, request_serializer=None, response_deserializer=None, *args, **kwargs):
+        return _BalancedMultiCallable(self._pool, lambda channel: channel.unary_stream(
+            method, request_serializer, response_deserializer, *args, **kwargs), response_streaming=True)
+
+    def stream_unary(self, method, request_serializer=None, response_deserializer=None, *args, **kwargs):
+        return _BalancedMultiCallable(self._pool, lambda channel: channel.stream_unary(
+            method, request_serializer, response_deserializer, *args, **kwargs), response_streaming=False)
+
+    def stream_stream(self, method, request_serializer=None, response_deserializer=None, *args, **kwargs):
+        return _BalancedMultiCallable(self._pool, lambda channel: channel.stream_stream(
+            method, request_serializer, response_deserializer, *args, **kwargs), response_streaming=True)
+
+    def close(self):
+        self._pool.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+        return False
+
+
+class GrpcChannelPool:
+    """
+    One channel per server replica, each behind its own circuit breaker.
+    Calls go to the less loaded of two random replicas (power of two choices), replicas with an open circuit are skipped.
+    `interceptors` wrap the pool as a whole, so a retry or a hedge picks a replica again instead of repeating the
+    attempt on the replica that just failed.
+    """
+
+    def __init__(self, addresses: List[str], create_channel: Callable[[str], grpc.Channel],
+                 create_breaker: Callable[[str], CircuitBreakerClientInterceptor], stub_class,
+                 interceptors: list = (), release_channel: Optional[Callable[[grpc.Channel], None]] = None):
+        """
+        :param release_channel: gives the channels back on close() instead of closing them,
+               for a `create_channel` that hands out shared ones
+        """
+        self._lock = threading.Lock()
+        self._release_channel = release_channel
+        self.targets = []
+        for address in addresses:
+            breaker = create_breaker(address)
+            raw_channel = create_channel(address)
+            self.targets.append(_Target(address, raw_channel, grpc.intercept_channel(raw_channel, breaker), breaker))
+        self.stub = stub_class(grpc.intercept_channel(_BalancedChannel(self), *interceptors))
+
+    def pick(self) -> _Target:
+        candidates = [target for target in self.targets if target.breaker.is_available()]
+        if not candidates:
+            # every circuit is open: the breaker of the least loaded target fails the call fast
+            candidates = self.targets
+        if len(candidates) == 1:
+            return candidates[0]
+        first, second = random.sample(candidates, 2)
+        return first if first.outstanding <= second.outstanding else second
+
+    def begin(self, target: _Target):
+        with self._lock:
+            target.outstanding += 1
+
+    def end(self, target: _Target):
+        with self._lock:
+            target.outstanding -= 1
+
+    def close(self):
+        for target in self.targets:
+            if self._release_channel is not None:
+                self._release_channel(target.raw_channel)
+            else:
+                target.raw_channel.close()
@@ -0,0 +1,108 @@
+import os
+import threading
+from typing import Dict, Iterable
+
+import grpc
+
+from src.interceptor.grpc_client_auth_interceptor import AuthInterceptor
+from src.utils import credentials
+
+
+class _SharedChannel:
+
+    def __init__(self, channel: grpc.Channel, certificate_version: int, ready: grpc.Future):
+        self.channel = channel
+        self.certificate_version = certificate_version
+        self.ready = ready
+        # handed out and not released yet
+        self.users = 0
+        # replaced by a channel with a newer certificate, closed once its last user releases it
+        self.retired = False
+
+
+class ChannelRegistry:
+    """
+    Process-wide TLS channels keyed by address, shared by every client in the process. A channel starts connecting
+    as soon as it is created, so the TLS handshake is usually done by the time of the first call. Once the server
+    certificate file changes, the next request for an address gets a new channel built with the new certificate;
+    clients still holding the old channel keep using it until they release it, then it is closed.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._channels: Dict[str, _SharedChannel] = {}
+        self._handed_out: Dict[grpc.Channel, _SharedChannel] = {}
+        self._call_credentials = None
+
+    def channel(self, address: str) -> grpc.Channel:
+        """
+        :return: the shared channel to `address`, to be given back with `release` once it is no longer used
+        """
+        certificate_file = credentials.server_certificate_file()
+        certificate = certificate_file.read()
+        unused = None
+        with self._lock:
+            shared = self._channels.get(address)
+            if shared is None or shared.certificate_version != certificate_file.version:
+                if shared is not None:
+                    unused = self._retire(shared)
+                channel = self._create_tls_channel(address, certificate)
+                # subscribing to readiness makes the channel connect now instead of on its first call
+                shared = self._channels[address] = _SharedChannel(channel, certificate_file.version,
+                                                                  grpc.channel_ready_future(channel))
+                self._handed_out[channel] = shared
+            shared.users += 1
+        if unused is not None:
+            unused.close()
+        return shared.channel
+
+    def release(self, channel: grpc.Channel):
+        unused = None
+        with self._lock:
+            shared = self._handed_out.get(channel)
+            if shared is None:
+                return
+            shared.users -= 1
+            if shared.retired and shared.users <= 0:
+                unused = self._handed_out.pop(channel).channel
+        if unused is not None:
+            unused.close()
+
+    def _retire(self, shared: _SharedChannel):
+        """
+        :return: the channel to close right away when nobody uses it any more
+        """
+        shared.retired = True
+        shared.ready.cancel()
+        if shared.users <= 0:
+            del self._handed_out[shared.channel]
+            return shared.channel
+        return None
+
+    def wait_until_ready(self, addresses: Iterable[str], timeout: float) -> bool:
+        """
+        Blocks until the channels of `addresses` are connected or `timeout` seconds have passed.
+        :return: whether every channel is connected
+        """
+        ready = [self._channels[address].ready for address in addresses if address in self._channels]
+        try:
+            for future in ready:
+                future.result(timeout=timeout)
+        except grpc.FutureTimeoutError:
+            return False
+        return True
+
+    def _create_tls_channel(self, address: str, certificate: bytes) -> grpc.Channel:
+        if self._call_credentials is None:
+            # one token for the whole process, refreshed in the background
+            self._call_credentials = grpc.metadata_call_credentials(AuthInterceptor(), name="auth gateway")
+        # Channel credential will be valid for the entire channel
+        channel_credential = grpc.ssl_channel_credentials(certificate)
+        # Combining channel credentials and call credentials together
+        composite_credentials = grpc.composite_channel_credentials(channel_credential, self._call_credentials)
+        # replicas are dialled by address, the certificate is still checked against the service host name
+        options = [('grpc.ssl_target_name_override', os.environ.get('SERVER_HOST'))]
+        return grpc.secure_channel(address, composite_credentials, options=options)
+
+
+CHANNELS = ChannelRegistry()
@@ -5,6 +5,23 @@ def _create_stream_request(provider_name='40_tonn', quality='4k'):
     return grpc_message_type.WatchStreamRequest(provider_name=provider_name, quality=quality)
 
 
+def _create_download_chunk_request(provider_name='40_tonn', quality='4k', offset=0):
+    return grpc_message_type.DownloadChunkRequest(provider_name=provider_name, quality=quality, offset=offset)
+
+
+def _resume_download_chunk_request(request, last_chunk):
+    next_offset = last_chunk.offset + len(last_chunk.data)
+    resumed = grpc_message_type.DownloadChunkRequest()
+    resumed.CopyFrom(request)
+    resumed.offset = next_offset
+    if request.length:
+        resumed.length = request.offset + request.length - next_offset
+        if resumed.length <= 0:
+            # a length of 0 would read to the end of the file
+            return None
+    return resumed
+
+
 def _from_proto_stream_update(stream_update):
     audio_data = stream_update.audio_chunk.audio_data.decode('utf-8')
     video_data = stream_update.video_frame.frame_data.decode('utf-8')
@@ -32,6 +49,14 @@ def _ordinal_interact_stream_update(order_number):
     )
 
 
+def _stream_update_batch(updates):
+    return grpc_message_type.StreamUpdate(batched_updates=updates)
+
+
+def _interact_stream_update_batch(updates):
+    return grpc_message_type.InteractStreamUpdate(batched_updates=updates)
+
+
 def _generate_stream_data():
     for update in range(3):
         stream_update = _ordinal_stream_update(update)
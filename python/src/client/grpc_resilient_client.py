@@ -4,80 +4,130 @@ import os
 import grpc
 
 import social_media_stream_pb2_grpc as grpc_stubs
+from src.client.grpc_channel_pool import GrpcChannelPool, resolve_targets
+from src.client.grpc_channel_registry import CHANNELS
 from src.client.grpc_data_utils import _create_stream_request, _from_proto_stream, _generate_stream_data, _generate_interact_stream_data, \
-    _from_proto_stream_update
-from src.interceptor.grpc_client_auth_interceptor import AuthInterceptor
+    _from_proto_stream_update, _create_download_chunk_request, _resume_download_chunk_request, _stream_update_batch, \
+    _interact_stream_update_batch
+from src.client.grpc_stream_batcher import batched_updates
 from src.interceptor.grpc_client_circuit_breaker import CircuitBreakerClientInterceptor
-from src.interceptor.grpc_client_retry_handler import RetryOnRpcErrorClientInterceptor, ExponentialBackoff
-from src.utils import credentials
+from src.interceptor.grpc_client_compression_interceptor import CompressionClientInterceptor
+from src.interceptor.grpc_client_hedging_handler import HedgingClientInterceptor, load_hedging_policies
+from src.interceptor.grpc_client_metrics_interceptor import MetricsClientInterceptor
+from src.interceptor.grpc_client_retry_handler import RetryOnRpcErrorClientInterceptor, ExponentialBackoff, RetryBudget
+from src.utils.compression import CompressionPolicy
+from src.utils.metrics import REGISTRY, start_metrics_server
+
+
+# overall budgets per call, retries and hedges included
+UNARY_TIMEOUT_S = 2
+STREAM_TIMEOUT_S = 5
+DOWNLOAD_TIMEOUT_S = 30
 
 
 class GrpcResilientClient:
 
     def __init__(self):
-        log.basicConfig(level=log.INFO, format='%(levelname)s - %(filename)s - %(message)s')
-        tls_channel = self._create_tls_channel()
         status_for_retry = [grpc.StatusCode.CANCELLED, grpc.StatusCode.UNAVAILABLE, grpc.StatusCode.DEADLINE_EXCEEDED]
         interceptors = [
+            # outermost, so a call is measured once from the caller's point of view, retries included
+            MetricsClientInterceptor(REGISTRY),
+            # video and audio are compressed already, only requests that actually shrink are sent compressed
+            CompressionClientInterceptor(CompressionPolicy.from_env()),
             RetryOnRpcErrorClientInterceptor(
                 max_attempts=3, sleeping_policy=ExponentialBackoff(init_backoff_ms=500, max_backoff_ms=5_000, multiplier=2),
-                status_for_retry=status_for_retry),
-            CircuitBreakerClientInterceptor(failure_threshold=3, recovery_timeout=5, status_for_retry=status_for_retry)
+                status_for_retry=status_for_retry, retry_budget=RetryBudget(max_tokens=10, token_ratio=0.1),
+                resume_handlers={'/SocialMediaStreamService/downloadStreamChunked': _resume_download_chunk_request},
+                metrics=REGISTRY),
         ]
-        # interceptor channel over the tls channel, so we take advantage from both
-        self.channel = grpc.intercept_channel(tls_channel, *interceptors)
-        self.stub = grpc_stubs.SocialMediaStreamServiceStub(self.channel)
+        hedging_config = os.environ.get('HEDGING_CONFIG')
+        if hedging_config:
+            # hedged copies sit below the retries, so a retry only happens once every hedge has failed
+            interceptors.append(HedgingClientInterceptor(load_hedging_policies(hedging_config)))
+        # interceptor channels over the tls channels, so we take advantage from both;
+        # every replica gets its own circuit breaker so one crashing server does not stall the others,
+        # while the retries and hedges above the pool move on to another replica.
+        # The tls channels are shared by every client of the process and already connecting by now.
+        self.pool = GrpcChannelPool(
+            resolve_targets(os.environ.get('SERVER_HOST'), os.environ.get('SERVER_PORT')),
+            create_channel=CHANNELS.channel,
+            release_channel=CHANNELS.release,
+            create_breaker=lambda address: CircuitBreakerClientInterceptor(failure_threshold=3, recovery_timeout=5,
+                                                                           status_for_retry=status_for_retry,
+                                                                           name=address, metrics=REGISTRY),
+            stub_class=grpc_stubs.SocialMediaStreamServiceStub,
+            interceptors=interceptors)
+        # STREAM_BATCH_MS coalesces streamed frames into batches flushed at least that often, unset sends them one by one
+        batch_ms = os.environ.get('STREAM_BATCH_MS')
+        self.batch_delay_s = float(batch_ms) / 1000 if batch_ms else None
+
+    def wait_until_ready(self, timeout: float) -> bool:
+        """
+        Waits for the connections to every server replica, so that not even the first call pays for a TLS handshake.
+        """
+        return CHANNELS.wait_until_ready([target.address for target in self.pool.targets], timeout)
+
+    def close(self):
+        # channels are shared with the other clients of the process, the registry closes them once they are retired
+        self.pool.close()
 
-    def download_stream(self):
+    def _batched(self, updates, create_batch):
+        if self.batch_delay_s is None:
+            return updates
+        return batched_updates(updates, create_batch, max_delay_s=self.batch_delay_s)
+
+    def download_stream(self, destination=None, timeout: float = None):
+        if destination is not None:
+            return self._download_stream_to_file(destination, timeout or DOWNLOAD_TIMEOUT_S)
         request = _create_stream_request()
         log.info('Sending request to download stream from %s using quality %s', request.provider_name, request.quality)
-        response = self.stub.downloadStream(request, wait_for_ready=True, timeout=2)
+        response = self.pool.stub.downloadStream(request, wait_for_ready=True, timeout=timeout or UNARY_TIMEOUT_S)
         log.info('Stream has been downloaded, data=%s', response.data.decode('utf-8'))
 
-    def watch_stream(self):
+    def _download_stream_to_file(self, destination, timeout: float):
+        # whatever is already on disk came from an earlier, interrupted download
+        offset = os.path.getsize(destination) if os.path.exists(destination) else 0
+        request = _create_download_chunk_request(offset=offset)
+        log.info('Sending request to download stream from %s using quality %s into %s starting at %d',
+                 request.provider_name, request.quality, destination, offset)
+        with open(destination, 'r+b' if offset else 'wb') as recording_file:
+            for chunk in self.pool.stub.downloadStreamChunked(request, wait_for_ready=True, timeout=timeout):
+                recording_file.seek(chunk.offset)
+                recording_file.write(chunk.data)
+        log.info('Stream has been downloaded into %s', destination)
+
+    def watch_stream(self, timeout: float = UNARY_TIMEOUT_S):
         request = _create_stream_request()
         log.info('Sending request to watch stream from %s using quality %s', request.provider_name, request.quality)
-        responses = self.stub.watchStream(request, wait_for_ready=True, timeout=2)
+        responses = self.pool.stub.watchStream(request, wait_for_ready=True, timeout=timeout)
         for response in responses:
             # Wow! Python can return tuple of few variables and use it next way to paste them into log!
             log.info('40_tonn showed %s and said: %s. Very wise!' % _from_proto_stream(response))
         log.info('Watch stream has ended')
 
-    def start_stream(self):
+    def start_stream(self, timeout: float = STREAM_TIMEOUT_S):
         log.info('Sending streaming requests...')
-        response = self.stub.startStream(_generate_stream_data(), wait_for_ready=True, timeout=5)
+        response = self.pool.stub.startStream(self._batched(_generate_stream_data(), _stream_update_batch),
+                                              wait_for_ready=True, timeout=timeout)
         log.info('Server response after streaming: %s', response.message)
 
-    def join_interact_stream(self):
+    def join_interact_stream(self, timeout: float = STREAM_TIMEOUT_S):
         log.info('Sending streaming requests interact...')
-        responses = self.stub.joinInteractStream(_generate_interact_stream_data(), wait_for_ready=True, timeout=5)
+        responses = self.pool.stub.joinInteractStream(
+            self._batched(_generate_interact_stream_data(), _interact_stream_update_batch),
+            wait_for_ready=True, timeout=timeout)
         for response in responses:
             log.info('Server response during interact streaming: %s', _from_proto_stream_update(response))
 
-    @staticmethod
-    def _create_tls_channel():
-        call_credentials = grpc.metadata_call_credentials(
-            AuthInterceptor(), name="auth gateway"
-        )
-        # # Channel credential will be valid for the entire channel
-        channel_credential = grpc.ssl_channel_credentials(
-            credentials.SERVER_CERTIFICATE
-        )
-        # # Combining channel credentials and call credentials together
-        composite_credentials = grpc.composite_channel_credentials(
-            channel_credential,
-            call_credentials,
-        )
-
-        tls_channel = grpc.secure_channel(f"{os.environ.get('SERVER_HOST')}:{os.environ.get('SERVER_PORT')}",
-                                          composite_credentials, compression=grpc.Compression.Gzip)
-        return tls_channel
-
 
 if __name__ == '__main__':
+    log.basicConfig(level=log.INFO, format='%(levelname)s - %(filename)s - %(message)s')
+    if os.environ.get('METRICS_PORT'):
+        start_metrics_server(int(os.environ['METRICS_PORT']))
     # run auth client
     auth_client = GrpcResilientClient()
     auth_client.download_stream()
     auth_client.watch_stream()
     auth_client.start_stream()
     auth_client.join_interact_stream()
+    auth_client.close()
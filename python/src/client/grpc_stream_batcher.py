@@ -0,0 +1,81 @@
+import queue
+import threading
+import time
+from typing import Callable, Iterator, List
+
+_END_OF_STREAM = object()
+# how often a pump waiting for room in a full queue checks whether the batches are still read
+PUT_TIMEOUT_S = 0.1
+
+
+class _SourceFailure:
+
+    def __init__(self, error: BaseException):
+        self.error = error
+
+
+def batched_updates(updates: Iterator, create_batch: Callable[[List], object], *, max_batch_bytes: int = 32 * 1024,
+                    max_delay_s: float = 0.005) -> Iterator:
+    """
+    Coalesces the updates of a client stream into batch messages, so high frame rates do not pay framing, compression
+    and interceptor costs for every frame. A batch is sent once it holds `max_batch_bytes` or its oldest update has
+    waited `max_delay_s`; an update that is alone when the batch is due is sent as it is.
+    :param create_batch: builds the batch message from a list of updates, e.g. StreamUpdate(batched_updates=updates)
+    """
+    # updates are pulled on a thread of their own, a source blocked waiting for the next frame cannot delay a flush
+    pending = queue.Queue(maxsize=256)
+    # set once nobody reads the batches any more, e.g. the call was cancelled, so the pump does not wait forever
+    stopped = threading.Event()
+
+    def offer(item) -> bool:
+        while not stopped.is_set():
+            try:
+                pending.put(item, timeout=PUT_TIMEOUT_S)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def pump():
+        try:
+            for update in updates:
+                if not offer(update):
+                    return
+        except BaseException as e:
+            offer(_SourceFailure(e))
+        else:
+            offer(_END_OF_STREAM)
+
+    threading.Thread(target=pump, name='stream-batcher', daemon=True).start()
+
+    def flush(batch):
+        return batch[0] if len(batch) == 1 else create_batch(batch)
+
+    batch = []
+    batch_bytes = 0
+    flush_at = 0.0
+    try:
+        while True:
+            try:
+                update = pending.get(timeout=max(flush_at - time.monotonic(), 0) if batch else None)
+            except queue.Empty:
+                yield flush(batch)
+                batch = []
+                batch_bytes = 0
+                continue
+            if update is _END_OF_STREAM or isinstance(update, _SourceFailure):
+                if batch:
+                    yield flush(batch)
+                if update is _END_OF_STREAM:
+                    return
+                raise update.error
+            if not batch:
+                flush_at = time.monotonic() + max_delay_s
+            batch.append(update)
+            batch_bytes += update.ByteSize()
+            if batch_bytes >= max_batch_bytes:
+                yield flush(batch)
+                batch = []
+                batch_bytes = 0
+    finally:
+        stopped.set()
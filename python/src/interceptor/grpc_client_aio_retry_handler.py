@@ -0,0 +1,79 @@
+import asyncio
+from typing import Any, Callable, Dict, List, Optional
+
+import grpc
+
+from src.interceptor.grpc_client_retry_handler import RetryInterceptorBase, SleepingPolicy, RetryBudget
+from src.utils.deadline import Deadline
+from src.utils.metrics import MetricsRegistry
+
+# Client streaming calls are not retried: an async request iterator cannot be replayed once consumed.
+
+
+class AsyncRetryUnaryUnaryClientInterceptor(RetryInterceptorBase, grpc.aio.UnaryUnaryClientInterceptor):
+
+    async def intercept_unary_unary(self, continuation, client_call_details, request):
+        deadline = Deadline(client_call_details.timeout)
+        for try_i in range(self.max_attempts):
+            call = await continuation(deadline.attempt_details(client_call_details), request)
+            code = await call.code()
+            if code == grpc.StatusCode.OK:
+                self._on_success()
+                return call
+            backoff_s = self._next_backoff_s(client_call_details.method, code, try_i, deadline)
+            if backoff_s is None:
+                return call
+            # only this coroutine waits, the event loop keeps serving every other call
+            await asyncio.sleep(backoff_s)
+
+
+class AsyncRetryUnaryStreamClientInterceptor(RetryInterceptorBase, grpc.aio.UnaryStreamClientInterceptor):
+
+    async def intercept_unary_stream(self, continuation, client_call_details, request):
+        # the first attempt starts before the responses are handed out, grpc.aio wraps them around its call
+        deadline = Deadline(client_call_details.timeout)
+        call = await continuation(deadline.attempt_details(client_call_details), request)
+        return self._retry_stream(continuation, client_call_details, request, deadline, call)
+
+    async def _retry_stream(self, continuation, client_call_details, request, deadline: Deadline, call):
+        method = client_call_details.method
+        resume = self.resume_handlers.get(method.decode() if isinstance(method, bytes) else method)
+        last_response = None
+
+        for try_i in range(self.max_attempts):
+            if try_i > 0:
+                call = await continuation(deadline.attempt_details(client_call_details), request)
+            try:
+                async for response in call:
+                    last_response = response
+                    yield response
+                self._on_success()
+                return
+            except grpc.aio.AioRpcError as e:
+                if resume is not None and last_response is not None:
+                    request = resume(request, last_response)
+                    if request is None:
+                        self._on_success()
+                        return
+                backoff_s = self._next_backoff_s(client_call_details.method, e.code(), try_i, deadline)
+                if backoff_s is None:
+                    raise
+                await asyncio.sleep(backoff_s)
+
+
+def async_retry_interceptors(
+        *,
+        max_attempts: int,
+        sleeping_policy: SleepingPolicy,
+        status_for_retry: List[grpc.StatusCode],
+        retry_budget: Optional[RetryBudget] = None,
+        resume_handlers: Optional[Dict[str, Callable[[Any, Any], Any]]] = None,
+        metrics: Optional[MetricsRegistry] = None
+) -> List[grpc.aio.ClientInterceptor]:
+    """
+    Retry interceptors for the `interceptors` of a grpc.aio channel. grpc.aio files an interceptor under the first
+    interface it implements only, so unary and server streaming calls each get their own.
+    """
+    options = dict(max_attempts=max_attempts, sleeping_policy=sleeping_policy, status_for_retry=status_for_retry,
+                   retry_budget=retry_budget, resume_handlers=resume_handlers, metrics=metrics)
+    return [AsyncRetryUnaryUnaryClientInterceptor(**options), AsyncRetryUnaryStreamClientInterceptor(**options)]
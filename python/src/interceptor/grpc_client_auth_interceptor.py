@@ -1,15 +1,58 @@
+import logging as log
 import os
+import threading
+import time
 
 import grpc
 import jwt
 
+# a token that could not be signed is tried again this soon, well before the current one expires
+RETRY_AFTER_FAILURE_S = 5
+
 
 class AuthInterceptor(grpc.AuthMetadataPlugin):
+
+    def __init__(self, token_ttl_s: int = 300, refresh_before_expiry_s: int = 30):
+        self._token_ttl_s = token_ttl_s
+        self._refresh_before_expiry_s = refresh_before_expiry_s
+        self._secret = os.environ.get('JWT_SECRET')
+        self._refresh_timer = None
+        self._metadata = None
+        self._closed = False
+        self._refresh()
+
     def __call__(self, context, callback):
-        token = self._create_jwt_token()
+        # Runs on the credentials callback thread for every RPC, so it only hands out the pre-signed token.
         # NOTE: The metadata keys provided to the callback must be lower-cased.
-        callback((('authorization', f'Bearer {token}'),), None)
+        metadata = self._metadata
+        if metadata is None:
+            callback((), RuntimeError('No JWT token could be signed yet'))
+            return
+        callback(metadata, None)
+
+    def close(self):
+        self._closed = True
+        if self._refresh_timer is not None:
+            self._refresh_timer.cancel()
+
+    def _refresh(self):
+        delay_s = RETRY_AFTER_FAILURE_S
+        try:
+            issued_at = int(time.time())
+            token = self._create_jwt_token(issued_at)
+            # swapping the whole tuple is atomic, callers never see a half-built value
+            self._metadata = (('authorization', f'Bearer {token}'),)
+            delay_s = max(self._token_ttl_s - self._refresh_before_expiry_s, 1)
+        except Exception:
+            # the current token stays in use until it expires, the next attempt comes sooner
+            log.exception('Could not sign a new JWT token, trying again in %s seconds', delay_s)
+        finally:
+            # the chain of refreshes must survive a failed one, otherwise every call fails once the token expires
+            if not self._closed:
+                self._refresh_timer = threading.Timer(delay_s, self._refresh)
+                self._refresh_timer.daemon = True
+                self._refresh_timer.start()
 
-    def _create_jwt_token(self):
-        payload = {'sub': 'python-client'}
-        return jwt.encode(payload, os.environ.get('JWT_SECRET'), algorithm='HS256')
+    def _create_jwt_token(self, issued_at: int):
+        payload = {'sub': 'python-client', 'iat': issued_at, 'exp': issued_at + self._token_ttl_s}
+        return jwt.encode(payload, self._secret, algorithm='HS256')
@@ -1,9 +1,86 @@
 import logging as log
+import threading
 import time
-from typing import Any, List
+from typing import Any, List, Optional
 
 import grpc
 
+from src.utils.metrics import MetricsRegistry
+
+
+class CircuitBreakerOpenError(grpc.RpcError):
+    """
+    Returned (or raised while iterating a stream) instead of making a call while the circuit is open.
+    Behaves like a failed call outcome, so outer interceptors and stubs treat it as any other RpcError.
+    """
+
+    def __init__(self, retry_after_s: float):
+        super().__init__()
+        self.retry_after_s = retry_after_s
+
+    def code(self):
+        return grpc.StatusCode.UNAVAILABLE
+
+    def details(self):
+        return f'Circuit breaker is opened. Cannot make any call to server for the next {self.retry_after_s:.1f} seconds.'
+
+    def initial_metadata(self):
+        return ()
+
+    def trailing_metadata(self):
+        return ()
+
+    def result(self, timeout=None):
+        raise self
+
+    def exception(self, timeout=None):
+        return self
+
+    def traceback(self, timeout=None):
+        return None
+
+    def done(self):
+        return True
+
+    def add_done_callback(self, fn):
+        fn(self)
+
+
+class _SlidingWindow:
+    # ring buffer of per-second buckets; a bucket is reset lazily when its slot comes around again
+
+    def __init__(self, window_s: int):
+        self._window_s = window_s
+        self._seconds = [0] * window_s
+        self._calls = [0] * window_s
+        self._failures = [0] * window_s
+
+    def record(self, now_s: int, failed: bool):
+        slot = now_s % self._window_s
+        if self._seconds[slot] != now_s:
+            self._seconds[slot] = now_s
+            self._calls[slot] = 0
+            self._failures[slot] = 0
+        self._calls[slot] += 1
+        if failed:
+            self._failures[slot] += 1
+
+    def totals(self, now_s: int):
+        calls = failures = 0
+        oldest = now_s - self._window_s
+        for slot in range(self._window_s):
+            if self._seconds[slot] > oldest:
+                calls += self._calls[slot]
+                failures += self._failures[slot]
+        return calls, failures
+
+    def reset(self):
+        self._calls = [0] * self._window_s
+        self._failures = [0] * self._window_s
+
+
+_STATE_VALUES = {'CLOSED': 0, 'HALF_OPENED': 1, 'OPENED': 2}
+
 
 class CircuitBreakerClientInterceptor(grpc.UnaryUnaryClientInterceptor, grpc.UnaryStreamClientInterceptor,
                                       grpc.StreamUnaryClientInterceptor,
@@ -12,44 +89,100 @@ class CircuitBreakerClientInterceptor(grpc.UnaryUnaryClientInterceptor, grpc.Una
     OPENED = 'OPENED'
     HALF_OPENED = 'HALF_OPENED'
 
-    def __init__(self, failure_threshold: int, recovery_timeout: int, status_for_retry: List[grpc.StatusCode]):
-        log.basicConfig(level=log.INFO, format='%(levelname)s - %(_failure_threshold) - %(message)s')
+    def __init__(self, failure_threshold: int, recovery_timeout: int, status_for_retry: List[grpc.StatusCode], *,
+                 failure_rate_threshold: float = 0.5, window_s: int = 10, half_open_max_calls: int = 1,
+                 name: str = 'default', metrics: Optional[MetricsRegistry] = None):
+        """
+        :param failure_threshold: minimal number of failures inside the window before the circuit may open
+        :param recovery_timeout: seconds the circuit stays open before probe calls are let through
+        :param status_for_retry: status codes counted as failures
+        :param failure_rate_threshold: share of failed calls inside the window that opens the circuit
+        :param window_s: length of the sliding window in seconds
+        :param half_open_max_calls: probe calls allowed while half-opened, all of them must succeed to close
+        :param name: identifies the breaker in logs and metrics, e.g. the target it protects
+        :param metrics: registry for the state gauge and transition counters
+        """
         self._failure_threshold = failure_threshold
         self._recovery_timeout = recovery_timeout
-        self._failure_count = 0
+        self._failure_rate_threshold = failure_rate_threshold
+        self._half_open_max_calls = half_open_max_calls
+        self.status_for_retry = frozenset(status_for_retry)
+        self._window = _SlidingWindow(window_s)
+        self._lock = threading.Lock()
         self._state = self.CLOSED
-        self._recovery_time = time.time()
-        self.status_for_retry = status_for_retry
-
-    @property
-    def failure_count(self):
-        # Getter continuation
-        return self._failure_count
-
-    @failure_count.setter
-    def failure_count(self, new_value):
-        if new_value == self._failure_threshold:
-            self.state = self.OPENED
-            self._failure_count = 0
-        elif new_value > self._failure_count and self._state == self.HALF_OPENED:
-            self.state = self.OPENED
-            self._failure_count = 0
-        else:
-            self._failure_count = new_value
+        self._opened_at = 0.0
+        self._probes_in_flight = 0
+        self._probe_successes = 0
+        self._name = name
+        self._metrics = metrics
+        self._state_gauge = None if metrics is None else metrics.gauge(
+            'grpc_client_circuit_breaker_state', 'Circuit breaker state: 0 closed, 1 half-opened, 2 opened', target=name)
 
     @property
     def state(self):
-        # Getter continuation
         return self._state
 
-    @state.setter
-    def state(self, new_value):
-        self._state = new_value
-        log.info('Circuit breaker is now %s!', new_value)
-        if new_value == self.OPENED:
-            self._recovery_time = time.time() + self._recovery_timeout
-        elif new_value == self.CLOSED:
-            self.failure_count = 0
+    def is_available(self) -> bool:
+        # cheap check without taking a probe permit, used to skip open targets
+        return self._state != self.OPENED or time.monotonic() >= self._opened_at + self._recovery_timeout
+
+    def _transition(self, new_state, now: float):
+        # callers hold the lock
+        self._state = new_state
+        if new_state == self.OPENED:
+            self._opened_at = now
+        elif new_state == self.HALF_OPENED:
+            self._probes_in_flight = 0
+            self._probe_successes = 0
+        else:
+            self._window.reset()
+        log.warning('Circuit breaker %s is now %s!', self._name, new_state)
+        if self._metrics is not None:
+            self._state_gauge.set(_STATE_VALUES[new_state])
+            self._metrics.counter('grpc_client_circuit_breaker_transitions_total', 'Circuit breaker state changes',
+                                  target=self._name, state=new_state).inc()
+
+    def _acquire(self):
+        """
+        :return: whether the call is a half-opened probe
+        :raise CircuitBreakerOpenError: the call is not permitted
+        """
+        if self._state == self.CLOSED:
+            return False
+        now = time.monotonic()
+        with self._lock:
+            if self._state == self.OPENED:
+                retry_after = self._opened_at + self._recovery_timeout - now
+                if retry_after > 0:
+                    raise CircuitBreakerOpenError(retry_after)
+                self._transition(self.HALF_OPENED, now)
+            if self._state == self.HALF_OPENED:
+                if self._probes_in_flight >= self._half_open_max_calls:
+                    raise CircuitBreakerOpenError(0)
+                self._probes_in_flight += 1
+                return True
+            return False
+
+    def _record(self, failed: bool, probe: bool):
+        now = time.monotonic()
+        with self._lock:
+            if probe:
+                if self._state != self.HALF_OPENED:
+                    return
+                self._probes_in_flight -= 1
+                if failed:
+                    self._transition(self.OPENED, now)
+                else:
+                    self._probe_successes += 1
+                    if self._probe_successes >= self._half_open_max_calls:
+                        self._transition(self.CLOSED, now)
+                return
+            now_s = int(now)
+            self._window.record(now_s, failed)
+            if failed and self._state == self.CLOSED:
+                calls, failures = self._window.totals(now_s)
+                if failures >= self._failure_threshold and failures >= calls * self._failure_rate_threshold:
+                    self._transition(self.OPENED, now)
 
     def _intercept_unary_call(
             self,
@@ -57,12 +190,13 @@ class CircuitBreakerClientInterceptor(grpc.UnaryUnaryClientInterceptor, grpc.Una
             call_details: grpc.ClientCallDetails,
             request_or_iterator: Any,
     ):
-        if not self._is_open_circuit():
-            log.info('Circuit breaker is closed. Making call...')
-            return self._call_unary(continuation, call_details, request_or_iterator)
-        else:
-            log.error('Circuit breaker is opened. Cannot make any call to server for the next %d seconds.',
-                      self._recovery_time - time.time())
+        try:
+            probe = self._acquire()
+        except CircuitBreakerOpenError as e:
+            return e
+        response = continuation(call_details, request_or_iterator)
+        self._record(isinstance(response, grpc.RpcError) and response.code() in self.status_for_retry, probe)
+        return response
 
     def _intercept_stream_call(
             self,
@@ -70,50 +204,16 @@ class CircuitBreakerClientInterceptor(grpc.UnaryUnaryClientInterceptor, grpc.Una
             call_details: grpc.ClientCallDetails,
             request_or_iterator: Any,
     ):
-        if not self._is_open_circuit():
-            log.info('Circuit breaker is closed. Making call...')
-            return self._call_stream(continuation, call_details, request_or_iterator)
-        else:
-            log.error('Circuit breaker is opened. Cannot make any call to server for the next %d seconds.',
-                      self._recovery_time - time.time())
-
-    def _call_unary(self,
-                    continuation,
-                    call_details: grpc.ClientCallDetails,
-                    request_or_iterator: Any,
-                    ):
-        response = continuation(call_details, request_or_iterator)
-        if isinstance(response, grpc.RpcError):
-            self.failure_count += 1
-        elif self.state == self.HALF_OPENED:
-            self.state = self.CLOSED
-            self.failure_count = 0
-        return response
-
-    def _call_stream(self,
-                     continuation,
-                     call_details: grpc.ClientCallDetails,
-                     request_or_iterator: Any,
-                     ):
+        probe = self._acquire()
+        failed = False
         try:
-            response = continuation(call_details, request_or_iterator)
-            for response in response:
+            for response in continuation(call_details, request_or_iterator):
                 yield response
         except grpc.RpcError as e:
-            if response.code() in self.status_for_retry:
-                self.failure_count += 1
-                return response
-            elif self.state == self.HALF_OPENED:
-                self.state = self.CLOSED
-                self.failure_count = 0
-                return list(response)
-            else:
-                return list(response)
-
-    def _is_open_circuit(self):
-        if self._recovery_time < time.time() and self.state == self.OPENED:
-            self.state = self.HALF_OPENED
-        return self.state == self.OPENED or self._recovery_time > time.time()
+            failed = e.code() in self.status_for_retry
+            raise
+        finally:
+            self._record(failed, probe)
 
     def intercept_unary_unary(self, continuation, client_call_details, request):
         return self._intercept_unary_call(continuation, client_call_details, request)
@@ -0,0 +1,42 @@
+import grpc
+
+from src.utils.call_details import replace_call_details
+from src.utils.compression import CompressionPolicy
+
+
+class CompressionClientInterceptor(grpc.UnaryUnaryClientInterceptor, grpc.UnaryStreamClientInterceptor,
+                                   grpc.StreamUnaryClientInterceptor, grpc.StreamStreamClientInterceptor):
+    # grpc only lets a client choose compression per call. Unary requests are checked before the call starts,
+    # streamed requests are sampled as they go and the outcome is used for the next call of the same method.
+
+    def __init__(self, policy: CompressionPolicy):
+        self._policy = policy
+
+    def _compressed(self, client_call_details, compression: grpc.Compression):
+        if client_call_details.compression is not None:
+            # the caller asked for a compression explicitly
+            return client_call_details
+        return replace_call_details(client_call_details, compression=compression)
+
+    def _sampled(self, method, request_iterator):
+        for request in request_iterator:
+            self._policy.choose(method, request)
+            yield request
+
+    def intercept_unary_unary(self, continuation, client_call_details, request):
+        compression = self._policy.choose(client_call_details.method, request)
+        return continuation(self._compressed(client_call_details, compression), request)
+
+    def intercept_unary_stream(self, continuation, client_call_details, request):
+        compression = self._policy.choose(client_call_details.method, request)
+        return continuation(self._compressed(client_call_details, compression), request)
+
+    def intercept_stream_unary(self, continuation, client_call_details, request_iterator):
+        method = client_call_details.method
+        return continuation(self._compressed(client_call_details, self._policy.last_choice(method)),
+                            self._sampled(method, request_iterator))
+
+    def intercept_stream_stream(self, continuation, client_call_details, request_iterator):
+        method = client_call_details.method
+        return continuation(self._compressed(client_call_details, self._policy.last_choice(method)),
+                            self._sampled(method, request_iterator))
@@ -0,0 +1,159 @@
+import asyncio
+import json
+from concurrent import futures
+from typing import Dict, List, NamedTuple, Optional
+
+import grpc
+
+from src.utils.deadline import Deadline
+
+
+class HedgingPolicy(NamedTuple):
+    max_attempts: int
+    hedging_delay_s: float
+    non_fatal_status_codes: List[grpc.StatusCode]
+
+
+def _parse_duration(duration: str) -> float:
+    # service config durations are protobuf Duration strings, e.g. "0.5s"
+    return float(duration.rstrip('s'))
+
+
+def load_hedging_policies(service_config_path: str) -> Dict[str, HedgingPolicy]:
+    """
+    Reads the `hedgingPolicy` entries of a gRPC service config.
+    :return: policies keyed by '/Service/method', or by '/Service/' when the entry covers the whole service
+    """
+    with open(service_config_path) as f:
+        service_config = json.load(f)
+
+    policies = {}
+    for method_config in service_config.get('methodConfig', []):
+        hedging_policy = method_config.get('hedgingPolicy')
+        if hedging_policy is None:
+            continue
+        policy = HedgingPolicy(
+            max_attempts=int(hedging_policy['maxAttempts']),
+            hedging_delay_s=_parse_duration(hedging_policy.get('hedgingDelay', '0s')),
+            non_fatal_status_codes=[grpc.StatusCode[code] for code in hedging_policy.get('nonFatalStatusCodes', [])]
+        )
+        for name in method_config['name']:
+            policies[f"/{name['service']}/{name.get('method', '')}"] = policy
+    return policies
+
+
+class _HedgingPolicies:
+
+    def __init__(self, policies: Dict[str, HedgingPolicy]):
+        self.policies = policies
+
+    def _policy_for(self, method) -> Optional[HedgingPolicy]:
+        if isinstance(method, bytes):
+            method = method.decode()
+        policy = self.policies.get(method)
+        if policy is None:
+            policy = self.policies.get(method[:method.rindex('/') + 1])
+        return policy
+
+    @staticmethod
+    def _hedge_delay_s(policy: HedgingPolicy, attempts: int, deadline: Deadline) -> Optional[float]:
+        """
+        :return: how long to wait for an outcome before sending one more copy, None when no more copies are sent
+        """
+        if attempts >= policy.max_attempts or not deadline.allows(policy.hedging_delay_s):
+            return None
+        return policy.hedging_delay_s
+
+
+class HedgingClientInterceptor(_HedgingPolicies, grpc.UnaryUnaryClientInterceptor):
+    # A blocking continuation cannot be cancelled from another thread, so losing attempts that are already
+    # in flight are abandoned and run into their own deadline; attempts that have not started yet are cancelled.
+
+    def __init__(self, policies: Dict[str, HedgingPolicy], max_concurrent_calls: int = 64):
+        """
+        :param max_concurrent_calls: hedged calls expected in flight at once; every attempt blocks a thread of its
+            own, so the pool holds enough for all their attempts and the first attempt of a call never waits for one
+        """
+        super().__init__(policies)
+        max_attempts = max((policy.max_attempts for policy in policies.values()), default=1)
+        # threads are started on demand, an idle client does not pay for the full pool
+        self._executor = futures.ThreadPoolExecutor(max_workers=max_concurrent_calls * max_attempts,
+                                                    thread_name_prefix='hedging')
+
+    def intercept_unary_unary(self, continuation, client_call_details, request):
+        policy = self._policy_for(client_call_details.method)
+        if policy is None or policy.max_attempts < 2:
+            return continuation(client_call_details, request)
+
+        # every copy gets the time left until the caller's deadline, not a fresh timeout of its own
+        deadline = Deadline(client_call_details.timeout)
+
+        def hedge():
+            return self._executor.submit(continuation, deadline.attempt_details(client_call_details), request)
+
+        pending = {hedge()}
+        attempts = 1
+        last_response = None
+        while pending:
+            timeout = self._hedge_delay_s(policy, attempts, deadline)
+            done, pending = futures.wait(pending, timeout=timeout, return_when=futures.FIRST_COMPLETED)
+            if not done:
+                # nothing came back within the hedging delay, send one more copy
+                pending.add(hedge())
+                attempts += 1
+                continue
+            for attempt in done:
+                last_response = attempt.result()
+                if not isinstance(last_response, grpc.RpcError) \
+                        or last_response.code() not in policy.non_fatal_status_codes:
+                    for loser in pending:
+                        loser.cancel()
+                    return last_response
+            if attempts < policy.max_attempts and deadline.allows(0):
+                # non-fatal failure: the next hedge is sent right away instead of waiting for the delay
+                pending.add(hedge())
+                attempts += 1
+        return last_response
+
+
+class AsyncHedgingClientInterceptor(_HedgingPolicies, grpc.aio.UnaryUnaryClientInterceptor):
+
+    @staticmethod
+    async def _outcome(call):
+        return call, await call.code()
+
+    async def intercept_unary_unary(self, continuation, client_call_details, request):
+        policy = self._policy_for(client_call_details.method)
+        if policy is None or policy.max_attempts < 2:
+            return await continuation(client_call_details, request)
+
+        deadline = Deadline(client_call_details.timeout)
+        calls = []
+
+        async def hedge():
+            call = await continuation(deadline.attempt_details(client_call_details), request)
+            calls.append(call)
+            return asyncio.ensure_future(self._outcome(call))
+
+        pending = {await hedge()}
+        last_call = None
+        try:
+            while pending:
+                timeout = self._hedge_delay_s(policy, len(calls), deadline)
+                done, pending = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    pending.add(await hedge())
+                    continue
+                for attempt in done:
+                    last_call, code = attempt.result()
+                    if code == grpc.StatusCode.OK or code not in policy.non_fatal_status_codes:
+                        return last_call
+                if len(calls) < policy.max_attempts and deadline.allows(0):
+                    pending.add(await hedge())
+            return last_call
+        finally:
+            for call in calls:
+                if call is not last_call:
+                    call.cancel()
+            for attempt in pending:
+                attempt.cancel()
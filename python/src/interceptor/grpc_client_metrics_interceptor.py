@@ -0,0 +1,72 @@
+import time
+
+import grpc
+
+from src.utils.metrics import MetricsRegistry, REGISTRY
+from src.utils.rpc_metrics import RpcMetrics
+
+
+class MetricsClientInterceptor(grpc.UnaryUnaryClientInterceptor, grpc.UnaryStreamClientInterceptor,
+                               grpc.StreamUnaryClientInterceptor, grpc.StreamStreamClientInterceptor):
+
+    def __init__(self, registry: MetricsRegistry = REGISTRY):
+        self._registry = registry
+        self._methods = {}
+
+    def _metrics(self, method: str) -> RpcMetrics:
+        metrics = self._methods.get(method)
+        if metrics is None:
+            metrics = self._methods[method] = RpcMetrics(self._registry, 'client', method)
+        return metrics
+
+    def _intercept_unary_call(self, continuation, client_call_details, request_or_iterator, request_streaming):
+        metrics = self._metrics(client_call_details.method)
+        if request_streaming:
+            request_or_iterator = metrics.count_sent(request_or_iterator)
+        else:
+            metrics.sent(request_or_iterator)
+        started = time.perf_counter()
+        outcome = continuation(client_call_details, request_or_iterator)
+
+        def on_done(future):
+            code = future.code()
+            if code == grpc.StatusCode.OK:
+                metrics.received(future.result())
+            metrics.finish(code.name, started)
+
+        # runs right away for blocking calls, on completion for `.future()` calls
+        outcome.add_done_callback(on_done)
+        return outcome
+
+    def _intercept_stream_call(self, continuation, client_call_details, request_or_iterator, request_streaming):
+        metrics = self._metrics(client_call_details.method)
+        if request_streaming:
+            request_or_iterator = metrics.count_sent(request_or_iterator)
+        else:
+            metrics.sent(request_or_iterator)
+        started = time.perf_counter()
+        code_name = 'OK'
+        try:
+            for response in continuation(client_call_details, request_or_iterator):
+                metrics.received(response)
+                yield response
+        except grpc.RpcError as e:
+            code_name = e.code().name
+            raise
+        except GeneratorExit:
+            code_name = grpc.StatusCode.CANCELLED.name
+            raise
+        finally:
+            metrics.finish(code_name, started)
+
+    def intercept_unary_unary(self, continuation, client_call_details, request):
+        return self._intercept_unary_call(continuation, client_call_details, request, False)
+
+    def intercept_unary_stream(self, continuation, client_call_details, request):
+        return self._intercept_stream_call(continuation, client_call_details, request, False)
+
+    def intercept_stream_unary(self, continuation, client_call_details, request_iterator):
+        return self._intercept_unary_call(continuation, client_call_details, request_iterator, True)
+
+    def intercept_stream_stream(self, continuation, client_call_details, request_iterator):
+        return self._intercept_stream_call(continuation, client_call_details, request_iterator, True)
@@ -1,83 +1,171 @@
 import abc
 import logging as log
+import threading
 import time
 from random import randint
-from typing import List
+from typing import Any, Callable, Dict, List, Optional
 
 import grpc
 
+from src.utils.deadline import Deadline
+from src.utils.metrics import MetricsRegistry
+
 
 class SleepingPolicy(abc.ABC):
     @abc.abstractmethod
-    def sleep(self, try_i: int):
+    def backoff_ms(self, try_i: int) -> int:
         """
         How long to sleep in milliseconds.
         :param try_i: the number of retry (starting from zero)
         """
         assert try_i >= 0
 
+    def sleep(self, try_i: int):
+        time.sleep(self.backoff_ms(try_i) / 1000)
+
 
 class ExponentialBackoff(SleepingPolicy):
     def __init__(self, *, init_backoff_ms: int, max_backoff_ms: int, multiplier: int):
-        self.init_backoff = randint(0, init_backoff_ms)
+        self.init_backoff = init_backoff_ms
         self.max_backoff = max_backoff_ms
         self.multiplier = multiplier
 
-    def sleep(self, try_i: int):
+    def backoff_ms(self, try_i: int) -> int:
+        # full jitter: a fresh random point in [0, capped exponential] for every attempt
         sleep_range = min(
             self.init_backoff * self.multiplier ** try_i, self.max_backoff
         )
         sleep_ms = randint(0, sleep_range)
-        log.debug(f"Sleeping for {sleep_ms}")
-        time.sleep(sleep_ms / 1000)
+        log.debug('Sleeping for %d', sleep_ms)
+        return sleep_ms
 
 
-class RetryOnRpcErrorClientInterceptor(
-    grpc.UnaryUnaryClientInterceptor, grpc.UnaryStreamClientInterceptor, grpc.StreamUnaryClientInterceptor,
-    grpc.StreamStreamClientInterceptor
-):
+class RetryBudget:
+    """
+    Token bucket shared by every call of a client, same semantics as `retryThrottling` in gRPC service config:
+    each failure takes a token, each success gives back `token_ratio`, and retries stop while the bucket
+    is at or below half, so an outage cannot be amplified by retries.
+    """
+
+    def __init__(self, *, max_tokens: int = 10, token_ratio: float = 0.1):
+        self._max_tokens = max_tokens
+        self._token_ratio = token_ratio
+        self._tokens = float(max_tokens)
+        self._lock = threading.Lock()
+
+    @property
+    def tokens(self):
+        return self._tokens
+
+    def on_success(self):
+        with self._lock:
+            self._tokens = min(self._tokens + self._token_ratio, self._max_tokens)
+
+    def on_failure(self) -> bool:
+        """
+        Records a retryable failure.
+        :return: whether the budget still allows a retry
+        """
+        with self._lock:
+            self._tokens = max(self._tokens - 1, 0)
+            return self._tokens > self._max_tokens / 2
+
+
+class RetryInterceptorBase:
+    """
+    Retry decisions shared by the sync and asyncio retry interceptors.
+    """
 
     def __init__(
             self,
             *,
             max_attempts: int,
             sleeping_policy: SleepingPolicy,
-            status_for_retry: List[grpc.StatusCode]
+            status_for_retry: List[grpc.StatusCode],
+            retry_budget: Optional[RetryBudget] = None,
+            resume_handlers: Optional[Dict[str, Callable[[Any, Any], Any]]] = None,
+            metrics: Optional[MetricsRegistry] = None
     ):
+        """
+        :param resume_handlers: per full method name, builds the request for the next attempt of a server stream
+            from the original request and the last received response, so a retry continues instead of starting over;
+            None when nothing is left to receive, the call is then complete
+        """
         self.max_attempts = max_attempts
         self.sleeping_policy = sleeping_policy
         self.status_for_retry = status_for_retry
+        self.retry_budget = retry_budget
+        self.resume_handlers = resume_handlers or {}
+        self.metrics = metrics
+
+    def _next_backoff_s(self, method, code: grpc.StatusCode, try_i: int, deadline: Deadline) -> Optional[float]:
+        """
+        :return: seconds to wait before the next attempt, None when the call should not be retried
+        """
+        # If status code is not in retryable status codes
+        if code not in self.status_for_retry:
+            return None
+        budget_left = self.retry_budget is None or self.retry_budget.on_failure()
+        # Return if it was last attempt
+        if not budget_left or try_i >= self.max_attempts - 1:
+            return None
+        backoff_s = self.sleeping_policy.backoff_ms(try_i) / 1000
+        if not deadline.allows(backoff_s):
+            # the next attempt would start after the caller has given up
+            log.debug('Not retrying %s, its deadline passes within the backoff', method)
+            return None
+        if self.metrics is not None:
+            self.metrics.counter('grpc_client_retries_total', 'Attempts repeated by the retry interceptor',
+                                 grpc_method=method, grpc_code=code.name).inc()
+        return backoff_s
+
+    def _on_success(self):
+        if self.retry_budget is not None:
+            self.retry_budget.on_success()
+
+
+class RetryOnRpcErrorClientInterceptor(
+    RetryInterceptorBase, grpc.UnaryUnaryClientInterceptor, grpc.UnaryStreamClientInterceptor,
+    grpc.StreamUnaryClientInterceptor, grpc.StreamStreamClientInterceptor
+):
 
     def _intercept_unary_call(self, continuation, client_call_details, request_or_iterator):
+        deadline = Deadline(client_call_details.timeout)
 
         for try_i in range(self.max_attempts):
-            response = continuation(client_call_details, request_or_iterator)
+            response = continuation(deadline.attempt_details(client_call_details), request_or_iterator)
             if isinstance(response, grpc.RpcError):
-                # Return if it was last attempt
-                if try_i == (self.max_attempts - 1):
+                backoff_s = self._next_backoff_s(client_call_details.method, response.code(), try_i, deadline)
+                if backoff_s is None:
                     return response
-
-                # If status code is not in retryable status codes
-                if response.code() not in self.status_for_retry:
-                    return response
-                self.sleeping_policy.sleep(try_i)
+                time.sleep(backoff_s)
             else:
+                self._on_success()
                 return response
 
-    def _intercept_stream_call(self, continuation, client_call_details, request_or_iterator):
+    def _intercept_stream_call(self, continuation, client_call_details, request_or_iterator, deadline: Deadline):
+        resume = self.resume_handlers.get(client_call_details.method)
+        last_response = None
 
         for try_i in range(self.max_attempts):
-            response = continuation(client_call_details, request_or_iterator)
+            responses = continuation(deadline.attempt_details(client_call_details), request_or_iterator)
 
             try:
-                for response in response:
+                for response in responses:
+                    last_response = response
                     yield response
+                self._on_success()
                 break
             except grpc.RpcError as e:
-                if response.code() not in self.status_for_retry or try_i == self.max_attempts - 1:
-                    return response
-                else:
-                    self.sleeping_policy.sleep(try_i)
+                if resume is not None and last_response is not None:
+                    request_or_iterator = resume(request_or_iterator, last_response)
+                    if request_or_iterator is None:
+                        self._on_success()
+                        break
+                backoff_s = self._next_backoff_s(client_call_details.method, e.code(), try_i, deadline)
+                if backoff_s is None:
+                    raise
+                time.sleep(backoff_s)
 
     def intercept_unary_unary(self, continuation, client_call_details, request):
         return self._intercept_unary_call(continuation, client_call_details, request)
@@ -87,8 +175,11 @@ class RetryOnRpcErrorClientInterceptor(
     ):
         return self._intercept_unary_call(continuation, client_call_details, request_iterator)
 
+    # the deadline starts with the call, not when the caller starts iterating the responses
     def intercept_unary_stream(self, continuation, client_call_details, request):
-        return self._intercept_stream_call(continuation, client_call_details, request)
+        return self._intercept_stream_call(continuation, client_call_details, request,
+                                           Deadline(client_call_details.timeout))
 
     def intercept_stream_stream(self, continuation, client_call_details, request_iterator):
-        return self._intercept_stream_call(continuation, client_call_details, request_iterator)
+        return self._intercept_stream_call(continuation, client_call_details, request_iterator,
+                                           Deadline(client_call_details.timeout))
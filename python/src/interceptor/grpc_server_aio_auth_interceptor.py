@@ -0,0 +1,26 @@
+import logging as log
+from typing import Optional
+
+import grpc
+
+from src.interceptor.grpc_server_auth_interceptor import CLIENTS, JwtVerifier
+from src.utils.metrics import MetricsRegistry
+
+
+class GrpcAsyncAuthServerInterceptor(grpc.aio.ServerInterceptor):
+    clients = CLIENTS
+
+    def __init__(self, verifier: JwtVerifier = None, metrics: Optional[MetricsRegistry] = None):
+        self.verifier = verifier or JwtVerifier(self.clients)
+        self._auth_failures = None if metrics is None else metrics.counter(
+            'grpc_server_auth_failures_total', 'Calls rejected because of a missing, invalid or unknown JWT')
+
+    async def intercept_service(self, continuation, handler_call_details):
+        try:
+            self.verifier.verify(handler_call_details.invocation_metadata)
+        except Exception:
+            log.error('An error occurred during decoding JWT token')
+            if self._auth_failures is not None:
+                self._auth_failures.inc()
+            raise
+        return await continuation(handler_call_details)
@@ -1,12 +1,43 @@
 import logging as log
 import os
+from typing import Optional
 
 import grpc
 import jwt
 
+from src.utils.metrics import MetricsRegistry
+from src.utils.token_cache import VerifiedTokenCache
+
+CLIENTS = frozenset(["kotlin-client", "python-client", "java-client"])
+
+
+class JwtVerifier:
+
+    def __init__(self, clients=CLIENTS, token_cache: VerifiedTokenCache = None):
+        self.clients = frozenset(clients)
+        self.token_cache = token_cache or VerifiedTokenCache()
+        # the secret is fixed for the lifetime of the pod, no need to read the environment on every call
+        self._secret = os.environ.get('JWT_SECRET')
+
+    def verify(self, invocation_metadata):
+        bearer = next((value for key, value in invocation_metadata if key == 'authorization'), None)
+
+        if bearer:
+            token = bearer.split(' ')[1]
+            payload = self.token_cache.get(token)
+            if payload is None:
+                payload = jwt.decode(token, key=self._secret, algorithms=['HS256'])
+                assert payload.get('sub') in self.clients
+                self.token_cache.put(token, payload)
+
 
 class GrpcAuthServerInterceptor(grpc.ServerInterceptor):
-    clients = ["kotlin-client", "python-client", "java-client"]
+    clients = CLIENTS
+
+    def __init__(self, verifier: JwtVerifier = None, metrics: Optional[MetricsRegistry] = None):
+        self.verifier = verifier or JwtVerifier(self.clients)
+        self._auth_failures = None if metrics is None else metrics.counter(
+            'grpc_server_auth_failures_total', 'Calls rejected because of a missing, invalid or unknown JWT')
 
     def intercept_service(self, continuation, handler_call_details):
         response = self.verify_jwt(continuation, handler_call_details)
@@ -27,17 +58,13 @@ class GrpcAuthServerInterceptor(grpc.ServerInterceptor):
 
     def verify_jwt(self, continuation, call_details):
         try:
-            headers = dict(call_details.invocation_metadata)
-            bearer = headers.get('authorization')
-
-            if bearer:
-                payload = jwt.decode(bearer.split(' ')[1], key=os.environ.get('JWT_SECRET'), algorithms=['HS256'])
-                assert payload.get('sub') in self.clients
-
+            self.verifier.verify(call_details.invocation_metadata)
             return continuation(call_details)
 
         except Exception:
             log.error('An error occurred during decoding JWT token')
+            if self._auth_failures is not None:
+                self._auth_failures.inc()
             raise
 
     def _intercept_streaming(self, iterator, context):
@@ -0,0 +1,81 @@
+import inspect
+
+import grpc
+
+from src.interceptor.grpc_server_handler_utils import wrap_rpc_handler
+from src.utils.compression import CompressionPolicy
+
+
+class _ResponseCompression:
+
+    def __init__(self, policy: CompressionPolicy):
+        self._policy = policy
+
+    def _prepare(self, method: str, context, response, first: bool):
+        if first:
+            # the algorithm goes out with the initial metadata, messages not worth it are then sent uncompressed one by one
+            context.set_compression(self._policy.algorithm)
+        if self._policy.choose(method, response) == grpc.Compression.NoCompression:
+            context.disable_next_message_compression()
+
+    def _wrap(self, method: str, handler):
+        if handler is None or not self._policy.enabled:
+            return handler
+        return wrap_rpc_handler(handler, lambda behavior, request_streaming, response_streaming:
+                                self._compressed(method, behavior, response_streaming))
+
+
+class CompressionServerInterceptor(_ResponseCompression, grpc.ServerInterceptor):
+    """
+    Compresses responses according to a CompressionPolicy, message by message.
+    """
+
+    def intercept_service(self, continuation, handler_call_details):
+        return self._wrap(handler_call_details.method, continuation(handler_call_details))
+
+    def _compressed(self, method: str, behavior, response_streaming):
+        if response_streaming:
+            def stream_behavior(request_or_iterator, context):
+                first = True
+                for response in behavior(request_or_iterator, context):
+                    self._prepare(method, context, response, first)
+                    first = False
+                    yield response
+
+            return stream_behavior
+
+        def unary_behavior(request_or_iterator, context):
+            response = behavior(request_or_iterator, context)
+            if response is not None:
+                self._prepare(method, context, response, True)
+            return response
+
+        return unary_behavior
+
+
+class AsyncCompressionServerInterceptor(_ResponseCompression, grpc.aio.ServerInterceptor):
+
+    async def intercept_service(self, continuation, handler_call_details):
+        return self._wrap(handler_call_details.method, await continuation(handler_call_details))
+
+    def _compressed(self, method: str, behavior, response_streaming):
+        if response_streaming:
+            async def stream_behavior(request_or_iterator, context):
+                first = True
+                responses = behavior(request_or_iterator, context)
+                if inspect.isawaitable(responses):
+                    responses = await responses
+                async for response in responses:
+                    self._prepare(method, context, response, first)
+                    first = False
+                    yield response
+
+            return stream_behavior
+
+        async def unary_behavior(request_or_iterator, context):
+            response = await behavior(request_or_iterator, context)
+            if response is not None:
+                self._prepare(method, context, response, True)
+            return response
+
+        return unary_behavior
@@ -0,0 +1,291 @@
+import logging as log
+import threading
+import time
+import weakref
+from typing import Optional
+
+import grpc
+
+from src.interceptor.grpc_server_handler_utils import wrap_rpc_handler
+from src.utils.metrics import MetricsRegistry
+
+
+def _deadline_exceeded(context) -> bool:
+    # aio contexts may report the raw integer status
+    return context.code() in (grpc.StatusCode.DEADLINE_EXCEEDED, grpc.StatusCode.DEADLINE_EXCEEDED.value[0])
+
+
+class AdaptiveConcurrencyLimit:
+    """
+    Number of calls of one method allowed in flight, adjusted by additive increase and multiplicative decrease (AIMD).
+    The limit grows by about one per limit's worth of fast calls and shrinks when latency rises well above its long-term
+    average or when a call runs out of time, so queueing shows up as rejections instead of ever growing latency.
+    """
+
+    def __init__(self, initial_limit: int = 10, min_limit: int = 2, max_limit: int = 500, backoff_ratio: float = 0.9,
+                 latency_tolerance: float = 2.0, smoothing: float = 0.05):
+        """
+        :param backoff_ratio: factor applied to the limit when the method is overloaded
+        :param latency_tolerance: a call slower than this many times the average latency signals overload
+        :param smoothing: weight of a new latency sample in the exponentially weighted average
+        """
+        self._limit = float(initial_limit)
+        self._min_limit = min_limit
+        self._max_limit = max_limit
+        self._backoff_ratio = backoff_ratio
+        self._latency_tolerance = latency_tolerance
+        self._smoothing = smoothing
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._latency_s = None
+        self._decreased_at = 0.0
+
+    @property
+    def limit(self) -> int:
+        return int(self._limit)
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    @property
+    def expected_latency_s(self) -> Optional[float]:
+        """
+        Average latency of the method, None until a call has finished.
+        """
+        return self._latency_s
+
+    def try_acquire(self) -> bool:
+        with self._lock:
+            if self._in_flight >= int(self._limit):
+                return False
+            self._in_flight += 1
+            return True
+
+    def abandon(self):
+        """
+        Gives back a permit of a call that never ran, the limit stays as it is.
+        """
+        with self._lock:
+            self._in_flight -= 1
+
+    def release(self, latency_s: Optional[float], overloaded: bool = False):
+        """
+        :param latency_s: time from admission to completion, None when it says nothing about the server's load
+        :param overloaded: the call failed in a way that shows the server is behind, e.g. its deadline passed
+        """
+        now = time.monotonic()
+        with self._lock:
+            in_flight = self._in_flight
+            self._in_flight -= 1
+            if latency_s is not None:
+                if self._latency_s is None:
+                    self._latency_s = latency_s
+                overloaded = overloaded or latency_s > self._latency_s * self._latency_tolerance
+                self._latency_s += self._smoothing * (latency_s - self._latency_s)
+            if overloaded:
+                # calls completing together report the same congestion, back off once per average call duration
+                if now - self._decreased_at >= (self._latency_s or 0):
+                    self._limit = max(self._min_limit, self._limit * self._backoff_ratio)
+                    self._decreased_at = now
+            elif in_flight * 2 >= self._limit:
+                # only grow while the limit is actually in use, an idle method keeps its limit
+                self._limit = min(self._max_limit, self._limit + 1 / self._limit)
+
+
+class _Permit:
+    # grpc never runs the behaviour of a unary call cancelled while it waits for a worker,
+    # so the permit is also given back once the wrapped behaviour is garbage collected
+
+    def __init__(self, limit: AdaptiveConcurrencyLimit):
+        self._limit = limit
+        self._released = False
+
+    def release(self, latency_s: Optional[float] = None, overloaded: bool = False):
+        if not self._released:
+            self._released = True
+            self._limit.release(latency_s, overloaded)
+
+    def bind(self, behavior):
+        weakref.finalize(behavior, self.release)
+        return behavior
+
+
+class _LoadShedding:
+
+    def __init__(self, metrics: Optional[MetricsRegistry], limit_options: dict):
+        self._metrics = metrics
+        self._limit_options = limit_options
+        self._limits = {}
+        # whether each method seen so far is unary, only known once its handler was looked up
+        self._unary = {}
+
+    def _limit(self, method: str) -> AdaptiveConcurrencyLimit:
+        limit = self._limits.get(method)
+        if limit is None:
+            limit = self._limits.setdefault(method, AdaptiveConcurrencyLimit(**self._limit_options))
+        return limit
+
+    def _is_limited(self, method: str) -> bool:
+        # streams stay open as long as the client wants, they would hold on to the permits of short calls
+        # and never tell how busy the server is, so only unary calls are limited
+        return self._unary.get(method, True)
+
+    def _learn(self, method: str, handler) -> bool:
+        """
+        :return: whether the handler is unary, so that calls to its method are limited
+        """
+        unary = handler is not None and not handler.request_streaming and not handler.response_streaming
+        if handler is not None:
+            self._unary[method] = unary
+        return unary
+
+    def _admit(self, method: str, limit: AdaptiveConcurrencyLimit, handler) -> bool:
+        """
+        Keeps the permit taken before the handler was known if the handler turns out to be unary.
+        """
+        unary = self._learn(method, handler)
+        if not unary:
+            limit.abandon()
+        return unary
+
+    def _shed(self, method: str, reason: str):
+        log.warning('Shedding call to %s: %s', method, reason)
+        if self._metrics is not None:
+            self._metrics.counter('grpc_server_shed_total', 'Calls rejected before running by the concurrency limiter',
+                                  grpc_method=method, reason=reason).inc()
+
+    def _export(self, method: str, limit: AdaptiveConcurrencyLimit):
+        if self._metrics is not None:
+            self._metrics.gauge('grpc_server_concurrency_limit', 'Calls allowed in flight',
+                                grpc_method=method).set(limit.limit)
+
+    def _cannot_finish_in_time(self, limit: AdaptiveConcurrencyLimit, context) -> bool:
+        remaining = context.time_remaining()
+        if remaining is None:
+            return False
+        # the call may have waited for a worker, whatever time is left has to cover the method's usual latency
+        return remaining <= (limit.expected_latency_s or 0)
+
+
+_OVERLOADED = 'Server is overloaded, try again later'
+
+
+class AdaptiveConcurrencyServerInterceptor(_LoadShedding, grpc.ServerInterceptor):
+    """
+    Limits in-flight unary calls per method. The limit is checked when the call arrives, before the rest of the
+    interceptors (JWT verification included) and before it queues for a worker thread, and excess calls fail at once
+    with RESOURCE_EXHAUSTED. Admitted calls whose deadline can no longer be met once they get a worker fail with
+    DEADLINE_EXCEEDED without running. Streaming calls are not limited; excess first calls of a method go through the
+    rest of the interceptors anyway, as only its handler tells whether it is streaming.
+    """
+
+    def __init__(self, metrics: Optional[MetricsRegistry] = None, **limit_options):
+        """
+        :param metrics: registry for limits and shed calls
+        :param limit_options: passed to every per-method AdaptiveConcurrencyLimit
+        """
+        super().__init__(metrics, limit_options)
+
+    def intercept_service(self, continuation, handler_call_details):
+        method = handler_call_details.method
+        if not self._is_limited(method):
+            return continuation(handler_call_details)
+        limit = self._limit(method)
+        if not limit.try_acquire():
+            if method not in self._unary:
+                # the first calls of a method: only its handler tells whether it is unary and may be shed
+                handler = continuation(handler_call_details)
+                if not self._learn(method, handler):
+                    return handler
+            self._shed(method, 'concurrency')
+            return grpc.unary_unary_rpc_method_handler(self._reject)
+        try:
+            handler = continuation(handler_call_details)
+        except BaseException:
+            limit.abandon()
+            raise
+        if not self._admit(method, limit, handler):
+            return handler
+        return wrap_rpc_handler(handler, lambda behavior, request_streaming, response_streaming:
+                                self._limited(method, limit, behavior))
+
+    @staticmethod
+    def _reject(request, context):
+        context.abort(grpc.StatusCode.RESOURCE_EXHAUSTED, _OVERLOADED)
+
+    def _limited(self, method: str, limit: AdaptiveConcurrencyLimit, behavior):
+        admitted = time.perf_counter()
+        permit = _Permit(limit)
+
+        def limited_behavior(request, context):
+            failed = True
+            try:
+                if self._cannot_finish_in_time(limit, context):
+                    self._shed(method, 'deadline')
+                    context.abort(grpc.StatusCode.DEADLINE_EXCEEDED, 'Not enough time left to handle the call')
+                response = behavior(request, context)
+                failed = False
+                return response
+            finally:
+                permit.release(None if failed else time.perf_counter() - admitted,
+                               overloaded=_deadline_exceeded(context))
+                self._export(method, limit)
+
+        return permit.bind(limited_behavior)
+
+
+class AsyncAdaptiveConcurrencyServerInterceptor(_LoadShedding, grpc.aio.ServerInterceptor):
+    """
+    AdaptiveConcurrencyServerInterceptor for grpc.aio servers, where the limit bounds coroutines in flight instead of
+    calls waiting for a thread.
+    """
+
+    def __init__(self, metrics: Optional[MetricsRegistry] = None, **limit_options):
+        super().__init__(metrics, limit_options)
+
+    async def intercept_service(self, continuation, handler_call_details):
+        method = handler_call_details.method
+        if not self._is_limited(method):
+            return await continuation(handler_call_details)
+        limit = self._limit(method)
+        if not limit.try_acquire():
+            if method not in self._unary:
+                handler = await continuation(handler_call_details)
+                if not self._learn(method, handler):
+                    return handler
+            self._shed(method, 'concurrency')
+            return grpc.unary_unary_rpc_method_handler(self._reject)
+        try:
+            handler = await continuation(handler_call_details)
+        except BaseException:
+            limit.abandon()
+            raise
+        if not self._admit(method, limit, handler):
+            return handler
+        return wrap_rpc_handler(handler, lambda behavior, request_streaming, response_streaming:
+                                self._limited(method, limit, behavior))
+
+    @staticmethod
+    async def _reject(request, context):
+        await context.abort(grpc.StatusCode.RESOURCE_EXHAUSTED, _OVERLOADED)
+
+    def _limited(self, method: str, limit: AdaptiveConcurrencyLimit, behavior):
+        admitted = time.perf_counter()
+        permit = _Permit(limit)
+
+        async def limited_behavior(request, context):
+            failed = True
+            try:
+                if self._cannot_finish_in_time(limit, context):
+                    self._shed(method, 'deadline')
+                    await context.abort(grpc.StatusCode.DEADLINE_EXCEEDED, 'Not enough time left to handle the call')
+                response = await behavior(request, context)
+                failed = False
+                return response
+            finally:
+                permit.release(None if failed else time.perf_counter() - admitted,
+                               overloaded=_deadline_exceeded(context))
+                self._export(method, limit)
+
+        return permit.bind(limited_behavior)
@@ -0,0 +1,360 @@
+import asyncio
+import inspect
+import itertools
+import json
+import logging as log
+import math
+import os
+import random
+import threading
+import time
+from typing import Callable, Dict, List, NamedTuple, Optional
+
+import grpc
+
+from src.interceptor.grpc_server_handler_utils import wrap_rpc_handler
+from src.utils.metrics import MetricsRegistry
+from src.utils.rpc_metrics import message_size
+
+# how often the config file is checked for changes
+RELOAD_CHECK_S = 1
+DEFAULT_FAILURE_CODES = ('CANCELLED', 'UNAVAILABLE', 'DEADLINE_EXCEEDED')
+
+
+class FaultSpec(NamedTuple):
+    failure_rate: float
+    failure_codes: List[grpc.StatusCode]
+    latency_probability: float
+    latency_s: Optional[Callable[[random.Random], float]]
+    mid_stream_failure_rate: float
+    fail_after_messages: int
+    bandwidth_bytes_per_s: Optional[float]
+
+
+def _latency_sampler(latency: dict) -> Callable[[random.Random], float]:
+    # durations in the config are milliseconds, samples are seconds
+    distribution = latency.get('distribution', 'fixed')
+    if distribution == 'fixed':
+        return lambda rng: latency['ms'] / 1000
+    if distribution == 'uniform':
+        return lambda rng: rng.uniform(latency['minMs'], latency['maxMs']) / 1000
+    if distribution == 'exponential':
+        return lambda rng: rng.expovariate(1 / latency['meanMs']) / 1000
+    if distribution == 'normal':
+        return lambda rng: max(rng.gauss(latency['meanMs'], latency['stddevMs']), 0) / 1000
+    if distribution == 'lognormal':
+        # long tail around a median, closest to what real backends show
+        return lambda rng: rng.lognormvariate(math.log(latency['medianMs']), latency['sigma']) / 1000
+    raise ValueError(f'Unknown latency distribution {distribution}')
+
+
+def _fault_spec(config: dict) -> FaultSpec:
+    latency = config.get('latency')
+    fail_after_messages = config.get('failAfterMessages')
+    return FaultSpec(
+        failure_rate=float(config.get('failureRate', 0)),
+        failure_codes=[grpc.StatusCode[code] for code in config.get('failureCodes', DEFAULT_FAILURE_CODES)],
+        latency_probability=float(latency.get('probability', 1)) if latency else 0,
+        latency_s=_latency_sampler(latency) if latency else None,
+        # a stream given a message count fails after it unless a rate says otherwise
+        mid_stream_failure_rate=float(config.get('midStreamFailureRate', 1 if fail_after_messages is not None else 0)),
+        fail_after_messages=int(fail_after_messages or 0),
+        bandwidth_bytes_per_s=config.get('bandwidthBytesPerS'),
+    )
+
+
+class _FaultConfig(NamedTuple):
+    seed: int
+    default: Optional[FaultSpec]
+    methods: Dict[str, FaultSpec]
+
+
+def parse_fault_config(config: dict) -> _FaultConfig:
+    """
+    Example, all fields optional:
+    {
+      "seed": 42,
+      "default": {"failureRate": 0.1, "failureCodes": ["UNAVAILABLE"]},
+      "methods": {
+        "/SocialMediaStreamService/downloadStream": {
+          "latency": {"distribution": "lognormal", "medianMs": 20, "sigma": 0.5, "probability": 0.5}
+        },
+        "/SocialMediaStreamService/watchStream": {
+          "failAfterMessages": 2, "midStreamFailureRate": 0.2, "bandwidthBytesPerS": 65536
+        }
+      }
+    }
+    Methods without an entry of their own use "default". Latency distributions are fixed (ms), uniform (minMs, maxMs),
+    exponential (meanMs), normal (meanMs, stddevMs) and lognormal (medianMs, sigma).
+    """
+    default = config.get('default')
+    return _FaultConfig(
+        seed=config['seed'] if 'seed' in config else random.randrange(2 ** 32),
+        default=_fault_spec(default) if default else None,
+        methods={method: _fault_spec(spec) for method, spec in config.get('methods', {}).items()},
+    )
+
+
+class _Throttle:
+    # messages leave no faster than the configured bandwidth, each one waits for the time its bytes take on the wire
+
+    def __init__(self, bytes_per_s: float):
+        self._bytes_per_s = bytes_per_s
+        self._available_at = time.monotonic()
+
+    def delay_s(self, message) -> float:
+        now = time.monotonic()
+        self._available_at = max(self._available_at, now) + message_size(message) / self._bytes_per_s
+        return self._available_at - now
+
+
+class _CallFaults(NamedTuple):
+    delay_s: float
+    failure_code: Optional[grpc.StatusCode]
+    # stream messages after which the call fails with `mid_stream_code`, None to let the stream finish
+    fail_after_messages: Optional[int]
+    mid_stream_code: Optional[grpc.StatusCode]
+    throttle: Optional[_Throttle]
+
+
+class FaultInjector:
+    """
+    Decides which faults each call gets. The n-th call of a method draws from a generator seeded with the seed,
+    the method and n, so a run is repeatable whatever the interleaving of calls to different methods.
+    A config loaded from a file is reloaded when the file changes; `update` replaces it programmatically.
+    """
+
+    def __init__(self, config: dict, path: Optional[str] = None, metrics: Optional[MetricsRegistry] = None):
+        self._config = parse_fault_config(config)
+        self._path = path
+        self._mtime_ns = os.stat(path).st_mtime_ns if path else None
+        self._next_check = time.monotonic() + RELOAD_CHECK_S
+        self._calls: Dict[str, itertools.count] = {}
+        self._lock = threading.Lock()
+        self._metrics = metrics
+
+    @classmethod
+    def from_file(cls, path: str, metrics: Optional[MetricsRegistry] = None) -> 'FaultInjector':
+        with open(path) as f:
+            return cls(json.load(f), path, metrics)
+
+    @classmethod
+    def from_failure_rate(cls, failure_rate: float, seed: Optional[int] = None,
+                          metrics: Optional[MetricsRegistry] = None) -> 'FaultInjector':
+        """
+        Fails the given share of every method's calls right away, as the servers used to do on their own.
+        """
+        config = {'default': {'failureRate': failure_rate}}
+        if seed is not None:
+            config['seed'] = seed
+        return cls(config, metrics=metrics)
+
+    @classmethod
+    def from_env(cls, metrics: Optional[MetricsRegistry] = None) -> 'FaultInjector':
+        """
+        FAULT_CONFIG names a config file, without it roughly 30% of calls fail unless FAILURE_RATE says otherwise.
+        """
+        path = os.environ.get('FAULT_CONFIG')
+        if path:
+            return cls.from_file(path, metrics)
+        return cls.from_failure_rate(float(os.environ.get('FAILURE_RATE', 0.3)), metrics=metrics)
+
+    def update(self, config: dict):
+        # swapping the whole config is atomic, a call never sees half of an old and half of a new one
+        self._config = parse_fault_config(config)
+        with self._lock:
+            self._calls = {}
+        log.info('Fault injection config updated')
+
+    def _reload_if_changed(self):
+        now = time.monotonic()
+        if self._path is None or now < self._next_check:
+            return
+        self._next_check = now + RELOAD_CHECK_S
+        try:
+            mtime_ns = os.stat(self._path).st_mtime_ns
+            if mtime_ns == self._mtime_ns:
+                return
+            self._mtime_ns = mtime_ns
+            with open(self._path) as f:
+                self.update(json.load(f))
+        except (OSError, ValueError, KeyError) as e:
+            log.error('Keeping the previous fault injection config, %s could not be loaded: %s', self._path, e)
+
+    def _rng(self, config: _FaultConfig, method: str) -> random.Random:
+        calls = self._calls.get(method)
+        if calls is None:
+            with self._lock:
+                calls = self._calls.setdefault(method, itertools.count())
+        return random.Random(f'{config.seed}:{method}:{next(calls)}')
+
+    def plan(self, method: str) -> Optional[_CallFaults]:
+        """
+        :return: the faults of the next call of `method`, None when it has none
+        """
+        self._reload_if_changed()
+        config = self._config
+        spec = config.methods.get(method, config.default)
+        if spec is None:
+            return None
+        rng = self._rng(config, method)
+        delay_s = spec.latency_s(rng) if spec.latency_s and rng.random() < spec.latency_probability else 0
+        failure_code = rng.choice(spec.failure_codes) if rng.random() < spec.failure_rate else None
+        fails_mid_stream = rng.random() < spec.mid_stream_failure_rate
+        faults = _CallFaults(
+            delay_s=delay_s,
+            failure_code=failure_code,
+            fail_after_messages=spec.fail_after_messages if fails_mid_stream else None,
+            mid_stream_code=rng.choice(spec.failure_codes) if fails_mid_stream else None,
+            throttle=_Throttle(spec.bandwidth_bytes_per_s) if spec.bandwidth_bytes_per_s else None,
+        )
+        if not any(faults):
+            return None
+        self._count(method, faults)
+        return faults
+
+    def _count(self, method: str, faults: _CallFaults):
+        if self._metrics is None:
+            return
+        for fault, injected in (('latency', faults.delay_s), ('failure', faults.failure_code),
+                                ('mid_stream_failure', faults.mid_stream_code), ('throttle', faults.throttle)):
+            if injected:
+                self._metrics.counter('grpc_server_injected_faults_total', 'Calls given a fault on purpose',
+                                      grpc_method=method, fault=fault).inc()
+
+
+class _FaultInjection:
+
+    def __init__(self, injector: FaultInjector):
+        self.injector = injector
+
+    @staticmethod
+    def _counts_requests(request_streaming, response_streaming) -> bool:
+        # mid-stream failures count responses, unless only the requests stream
+        return request_streaming and not response_streaming
+
+
+class FaultInjectionServerInterceptor(_FaultInjection, grpc.ServerInterceptor):
+
+    def intercept_service(self, continuation, handler_call_details):
+        handler = continuation(handler_call_details)
+        method = handler_call_details.method
+        return wrap_rpc_handler(handler, lambda behavior, request_streaming, response_streaming:
+                                self._faulty(method, behavior, request_streaming, response_streaming))
+
+    def _faulty(self, method: str, behavior, request_streaming, response_streaming):
+        counts_requests = self._counts_requests(request_streaming, response_streaming)
+
+        def start(context) -> Optional[_CallFaults]:
+            faults = self.injector.plan(method)
+            if faults is None:
+                return None
+            if faults.delay_s:
+                time.sleep(faults.delay_s)
+            if faults.failure_code is not None:
+                context.abort(faults.failure_code, 'SIMULATION')
+            return faults
+
+        def pass_message(faults: _CallFaults, context, message, passed: Optional[int]):
+            # `passed` is None for messages that do not count towards a mid-stream failure
+            if faults.throttle is not None:
+                time.sleep(faults.throttle.delay_s(message))
+            if faults.mid_stream_code is not None and passed is not None and passed == faults.fail_after_messages:
+                context.abort(faults.mid_stream_code, 'SIMULATION')
+
+        def requests(faults: _CallFaults, request_iterator, context):
+            for passed, request in enumerate(request_iterator):
+                pass_message(faults, context, request, passed if counts_requests else None)
+                yield request
+
+        def handle_requests(faults: Optional[_CallFaults], request_or_iterator, context):
+            if faults is None or not request_streaming:
+                return request_or_iterator
+            return requests(faults, request_or_iterator, context)
+
+        if response_streaming:
+            def stream_behavior(request_or_iterator, context):
+                faults = start(context)
+                responses = behavior(handle_requests(faults, request_or_iterator, context), context)
+                if faults is None:
+                    yield from responses
+                    return
+                for passed, response in enumerate(responses):
+                    pass_message(faults, context, response, passed)
+                    yield response
+
+            return stream_behavior
+
+        def unary_behavior(request_or_iterator, context):
+            faults = start(context)
+            response = behavior(handle_requests(faults, request_or_iterator, context), context)
+            if faults is not None and faults.throttle is not None and response is not None:
+                time.sleep(faults.throttle.delay_s(response))
+            return response
+
+        return unary_behavior
+
+
+class AsyncFaultInjectionServerInterceptor(_FaultInjection, grpc.aio.ServerInterceptor):
+
+    async def intercept_service(self, continuation, handler_call_details):
+        handler = await continuation(handler_call_details)
+        method = handler_call_details.method
+        return wrap_rpc_handler(handler, lambda behavior, request_streaming, response_streaming:
+                                self._faulty(method, behavior, request_streaming, response_streaming))
+
+    def _faulty(self, method: str, behavior, request_streaming, response_streaming):
+        counts_requests = self._counts_requests(request_streaming, response_streaming)
+
+        async def start(context) -> Optional[_CallFaults]:
+            faults = self.injector.plan(method)
+            if faults is None:
+                return None
+            if faults.delay_s:
+                await asyncio.sleep(faults.delay_s)
+            if faults.failure_code is not None:
+                await context.abort(faults.failure_code, 'SIMULATION')
+            return faults
+
+        async def pass_message(faults: _CallFaults, context, message, passed: Optional[int]):
+            # `passed` is None for messages that do not count towards a mid-stream failure
+            if faults.throttle is not None:
+                await asyncio.sleep(faults.throttle.delay_s(message))
+            if faults.mid_stream_code is not None and passed is not None and passed == faults.fail_after_messages:
+                await context.abort(faults.mid_stream_code, 'SIMULATION')
+
+        async def requests(faults: _CallFaults, request_iterator, context):
+            passed = 0
+            async for request in request_iterator:
+                await pass_message(faults, context, request, passed if counts_requests else None)
+                passed += 1
+                yield request
+
+        def handle_requests(faults: Optional[_CallFaults], request_or_iterator, context):
+            if faults is None or not request_streaming:
+                return request_or_iterator
+            return requests(faults, request_or_iterator, context)
+
+        if response_streaming:
+            async def stream_behavior(request_or_iterator, context):
+                faults = await start(context)
+                responses = behavior(handle_requests(faults, request_or_iterator, context), context)
+                if inspect.isawaitable(responses):
+                    responses = await responses
+                passed = 0
+                async for response in responses:
+                    if faults is not None:
+                        await pass_message(faults, context, response, passed)
+                    passed += 1
+                    yield response
+
+            return stream_behavior
+
+        async def unary_behavior(request_or_iterator, context):
+            faults = await start(context)
+            response = await behavior(handle_requests(faults, request_or_iterator, context), context)
+            if faults is not None and faults.throttle is not None and response is not None:
+                await asyncio.sleep(faults.throttle.delay_s(response))
+            return response
+
+        return unary_behavior
@@ -0,0 +1,21 @@
+import grpc
+
+
+def wrap_rpc_handler(handler: grpc.RpcMethodHandler, wrap_behavior) -> grpc.RpcMethodHandler:
+    """
+    Rebuilds a method handler around a wrapped behaviour, keeping its (de)serializers.
+    :param wrap_behavior: called with (behavior, request_streaming, response_streaming), returns the new behaviour
+    """
+    if handler is None:
+        return None
+    if handler.request_streaming and handler.response_streaming:
+        behavior, handler_factory = handler.stream_stream, grpc.stream_stream_rpc_method_handler
+    elif handler.request_streaming:
+        behavior, handler_factory = handler.stream_unary, grpc.stream_unary_rpc_method_handler
+    elif handler.response_streaming:
+        behavior, handler_factory = handler.unary_stream, grpc.unary_stream_rpc_method_handler
+    else:
+        behavior, handler_factory = handler.unary_unary, grpc.unary_unary_rpc_method_handler
+    return handler_factory(wrap_behavior(behavior, handler.request_streaming, handler.response_streaming),
+                           request_deserializer=handler.request_deserializer,
+                           response_serializer=handler.response_serializer)
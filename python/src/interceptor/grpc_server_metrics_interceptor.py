@@ -0,0 +1,150 @@
+import inspect
+import time
+
+import grpc
+
+from src.interceptor.grpc_server_handler_utils import wrap_rpc_handler
+from src.utils.metrics import MetricsRegistry, REGISTRY
+from src.utils.rpc_metrics import RpcMetrics
+
+
+_CODE_NAMES = {status.value[0]: status.name for status in grpc.StatusCode}
+
+
+def _code_name(context) -> str:
+    code = context.code()
+    if code is None:
+        return 'OK'
+    if isinstance(code, grpc.StatusCode):
+        return code.name
+    # aio contexts may report the raw integer status
+    return _CODE_NAMES.get(code, 'UNKNOWN')
+
+
+def _failure_code_name(context) -> str:
+    code_name = _code_name(context)
+    return 'UNKNOWN' if code_name == 'OK' else code_name
+
+
+class _Instrumentation:
+
+    def __init__(self, registry: MetricsRegistry):
+        self._registry = registry
+        self._methods = {}
+
+    def _metrics(self, method: str) -> RpcMetrics:
+        metrics = self._methods.get(method)
+        if metrics is None:
+            metrics = self._methods[method] = RpcMetrics(self._registry, 'server', method)
+        return metrics
+
+
+class MetricsServerInterceptor(_Instrumentation, grpc.ServerInterceptor):
+
+    def __init__(self, registry: MetricsRegistry = REGISTRY):
+        super().__init__(registry)
+
+    def intercept_service(self, continuation, handler_call_details):
+        metrics = self._metrics(handler_call_details.method)
+        return wrap_rpc_handler(continuation(handler_call_details),
+                                lambda behavior, request_streaming, response_streaming:
+                                self._instrument(metrics, behavior, request_streaming, response_streaming))
+
+    @staticmethod
+    def _instrument(metrics: RpcMetrics, behavior, request_streaming, response_streaming):
+
+        def receive(request_or_iterator):
+            if request_streaming:
+                return metrics.count_received(request_or_iterator)
+            metrics.received(request_or_iterator)
+            return request_or_iterator
+
+        if response_streaming:
+            def stream_behavior(request_or_iterator, context):
+                started = time.perf_counter()
+                code_name = 'OK'
+                try:
+                    for response in behavior(receive(request_or_iterator), context):
+                        metrics.sent(response)
+                        yield response
+                    code_name = _code_name(context)
+                except Exception:
+                    code_name = _failure_code_name(context)
+                    raise
+                finally:
+                    metrics.finish(code_name, started)
+
+            return stream_behavior
+
+        def unary_behavior(request_or_iterator, context):
+            started = time.perf_counter()
+            code_name = 'OK'
+            try:
+                response = behavior(receive(request_or_iterator), context)
+                metrics.sent(response)
+                code_name = _code_name(context)
+                return response
+            except Exception:
+                code_name = _failure_code_name(context)
+                raise
+            finally:
+                metrics.finish(code_name, started)
+
+        return unary_behavior
+
+
+class AsyncMetricsServerInterceptor(_Instrumentation, grpc.aio.ServerInterceptor):
+
+    def __init__(self, registry: MetricsRegistry = REGISTRY):
+        super().__init__(registry)
+
+    async def intercept_service(self, continuation, handler_call_details):
+        metrics = self._metrics(handler_call_details.method)
+        return wrap_rpc_handler(await continuation(handler_call_details),
+                                lambda behavior, request_streaming, response_streaming:
+                                self._instrument(metrics, behavior, request_streaming, response_streaming))
+
+    @staticmethod
+    def _instrument(metrics: RpcMetrics, behavior, request_streaming, response_streaming):
+
+        def receive(request_or_iterator):
+            if request_streaming:
+                return metrics.async_count_received(request_or_iterator)
+            metrics.received(request_or_iterator)
+            return request_or_iterator
+
+        if response_streaming:
+            async def stream_behavior(request_or_iterator, context):
+                started = time.perf_counter()
+                code_name = 'OK'
+                try:
+                    responses = behavior(receive(request_or_iterator), context)
+                    if inspect.isawaitable(responses):
+                        responses = await responses
+                    async for response in responses:
+                        metrics.sent(response)
+                        yield response
+                    code_name = _code_name(context)
+                except BaseException:
+                    code_name = _failure_code_name(context)
+                    raise
+                finally:
+                    metrics.finish(code_name, started)
+
+            return stream_behavior
+
+        async def unary_behavior(request_or_iterator, context):
+            started = time.perf_counter()
+            code_name = 'OK'
+            try:
+                response = await behavior(receive(request_or_iterator), context)
+                metrics.sent(response)
+                code_name = _code_name(context)
+                return response
+            except BaseException:
+                code_name = _failure_code_name(context)
+                raise
+            finally:
+                metrics.finish(code_name, started)
+
+        return unary_behavior
@@ -0,0 +1,189 @@
+import asyncio
+import logging as log
+import threading
+import time
+from typing import Callable, Dict, Iterator, NamedTuple, Optional, Tuple
+
+import social_media_stream_pb2
+
+
+# how often a viewer waiting for the next frame checks that its client and the producer are still there
+WAKEUP_TIMEOUT_S = 1
+
+
+class BroadcastInterrupted(Exception):
+    pass
+
+
+class _Frame(NamedTuple):
+    sequence: int
+    payload: bytes
+    keyframe: bool
+
+
+def demo_frames(provider_name: str, keyframe_interval: int = 30) -> Iterator[Tuple[social_media_stream_pb2.StreamUpdate, bool]]:
+    i = 0
+    while True:
+        yield social_media_stream_pb2.StreamUpdate(audio_chunk=social_media_stream_pb2.AudioChunk(audio_data=f'Audio{i}'.encode()),
+                                                   video_frame=social_media_stream_pb2.VideoFrame(frame_data=f'Video{i}'.encode())), \
+            i % keyframe_interval == 0
+        i += 1
+
+
+class BroadcastHub:
+    """
+    Live frames of one provider, shared by all of its viewers.
+    A producer thread serializes every frame once into a bounded ring buffer and each subscriber reads it at its own cursor.
+    A subscriber that falls more than `capacity` frames behind skips to the latest keyframe instead of slowing the others down.
+    """
+
+    def __init__(self, provider_name: str, *, capacity: int = 256, frame_interval_s: float = 1 / 30,
+                 frame_source: Callable[[str], Iterator[Tuple[social_media_stream_pb2.StreamUpdate, bool]]] = demo_frames):
+        self.provider_name = provider_name
+        self._capacity = capacity
+        self._frame_interval_s = frame_interval_s
+        self._frame_source = frame_source
+        self._ring = [None] * capacity
+        self._next_sequence = 0
+        self._keyframe_sequence = 0
+        self._lock = threading.Lock()
+        self._subscribers = set()
+        self._producer = None
+        self.skipped_frames = 0
+
+    def publish(self, stream_update: social_media_stream_pb2.StreamUpdate, keyframe: bool = False):
+        payload = stream_update.SerializeToString()
+        with self._lock:
+            sequence = self._next_sequence
+            self._ring[sequence % self._capacity] = _Frame(sequence, payload, keyframe)
+            self._next_sequence = sequence + 1
+            if keyframe:
+                self._keyframe_sequence = sequence
+            wakeups = tuple(self._subscribers)
+        for wakeup in wakeups:
+            wakeup()
+
+    def read(self, cursor: int):
+        """
+        :return: frames published since `cursor` and the cursor to continue from
+        """
+        with self._lock:
+            if cursor < self._next_sequence - self._capacity:
+                # overrun: everything between is gone, continue from the newest decodable frame
+                latest = self._keyframe_sequence if self._keyframe_sequence >= self._next_sequence - self._capacity \
+                    else self._next_sequence - 1
+                self.skipped_frames += latest - cursor
+                cursor = latest
+            frames = [self._ring[sequence % self._capacity].payload for sequence in range(cursor, self._next_sequence)]
+            return frames, self._next_sequence
+
+    def subscribe(self, wakeup: Callable[[], None]) -> int:
+        with self._lock:
+            self._subscribers.add(wakeup)
+            if self._producer is None or not self._producer.is_alive():
+                # a new session, frames of the previous one must not be replayed
+                self._ring = [None] * self._capacity
+                self._keyframe_sequence = self._next_sequence
+                self._producer = threading.Thread(target=self._produce, name=f'broadcast-{self.provider_name}', daemon=True)
+                self._producer.start()
+            # start at the latest keyframe so the first frame a viewer gets is decodable
+            return self._keyframe_sequence
+
+    def unsubscribe(self, wakeup: Callable[[], None]):
+        with self._lock:
+            self._subscribers.discard(wakeup)
+
+    def _produce(self):
+        try:
+            next_frame_at = time.monotonic()
+            for stream_update, keyframe in self._frame_source(self.provider_name):
+                with self._lock:
+                    if not self._subscribers:
+                        # cleared under the lock, so a viewer arriving now starts a new producer
+                        self._producer = None
+                        return
+                self.publish(stream_update, keyframe)
+                next_frame_at += self._frame_interval_s
+                time.sleep(max(next_frame_at - time.monotonic(), 0))
+        except Exception:
+            log.exception('Producer of %s failed', self.provider_name)
+        with self._lock:
+            if self._producer is threading.current_thread():
+                self._producer = None
+            wakeups = tuple(self._subscribers)
+        # viewers waiting for the next frame learn right away that none is coming
+        for wakeup in wakeups:
+            wakeup()
+
+    def _producing(self) -> bool:
+        with self._lock:
+            return self._producer is not None and self._producer.is_alive()
+
+    def _check_producing(self, payloads):
+        if not payloads and not self._producing():
+            raise BroadcastInterrupted(f'The broadcast of {self.provider_name} has stopped')
+
+    def frames(self, limit: int = None, is_active: Optional[Callable[[], bool]] = None) -> Iterator[bytes]:
+        """
+        :param is_active: tells whether the viewer is still there, e.g. `context.is_active`
+        :raises BroadcastInterrupted: once the producer has stopped and every frame it published was delivered
+        """
+        wakeup = threading.Event()
+        cursor = self.subscribe(wakeup.set)
+        sent = 0
+        try:
+            while True:
+                payloads, cursor = self.read(cursor)
+                for payload in payloads[:None if limit is None else limit - sent]:
+                    yield payload
+                    sent += 1
+                if limit is not None and sent >= limit:
+                    return
+                self._check_producing(payloads)
+                # a viewer that went away gives its worker thread back even though no frame arrives
+                if not wakeup.wait(WAKEUP_TIMEOUT_S) and is_active is not None and not is_active():
+                    return
+                wakeup.clear()
+        finally:
+            self.unsubscribe(wakeup.set)
+
+    async def async_frames(self, limit: int = None):
+        loop = asyncio.get_running_loop()
+        event = asyncio.Event()
+
+        def wakeup():
+            loop.call_soon_threadsafe(event.set)
+
+        cursor = self.subscribe(wakeup)
+        sent = 0
+        try:
+            while True:
+                payloads, cursor = self.read(cursor)
+                for payload in payloads[:None if limit is None else limit - sent]:
+                    yield payload
+                    sent += 1
+                if limit is not None and sent >= limit:
+                    return
+                self._check_producing(payloads)
+                try:
+                    await asyncio.wait_for(event.wait(), WAKEUP_TIMEOUT_S)
+                except asyncio.TimeoutError:
+                    pass
+                event.clear()
+        finally:
+            self.unsubscribe(wakeup)
+
+
+class BroadcastHubRegistry:
+
+    def __init__(self, **hub_options):
+        self._hub_options = hub_options
+        self._hubs: Dict[str, BroadcastHub] = {}
+        self._lock = threading.Lock()
+
+    def hub(self, provider_name: str) -> BroadcastHub:
+        with self._lock:
+            hub = self._hubs.get(provider_name)
+            if hub is None:
+                hub = self._hubs[provider_name] = BroadcastHub(provider_name, **self._hub_options)
+            return hub
@@ -0,0 +1,141 @@
+import asyncio
+import logging as log
+import os
+import signal
+
+import grpc
+
+import social_media_stream_pb2
+import social_media_stream_pb2_grpc
+from src.interceptor import grpc_server_aio_auth_interceptor
+from src.interceptor.grpc_server_compression_interceptor import AsyncCompressionServerInterceptor
+from src.interceptor.grpc_server_concurrency_limiter import AsyncAdaptiveConcurrencyServerInterceptor
+from src.interceptor.grpc_server_fault_injection import AsyncFaultInjectionServerInterceptor, FaultInjector
+from src.interceptor.grpc_server_metrics_interceptor import AsyncMetricsServerInterceptor
+from src.server.grpc_broadcast_hub import BroadcastHubRegistry, BroadcastInterrupted
+from src.server.grpc_crashing_server import create_server_credentials, SHUTDOWN_GRACE_S
+from src.server.grpc_interact_rooms import InteractRoomRegistry, Participant, raw_audio_data, raw_provider_name, \
+    raw_unbatched, GREETING_REPLY, FAREWELL_REPLY
+from src.server.grpc_recording_store import RecordingStore
+from src.server.grpc_response_cache import AsyncResponseCache
+from src.server.grpc_stream_batches import async_unbatched
+from src.server.grpc_service_handlers import add_servicer_to_server
+from src.server.grpc_stream_sink import AsyncStreamIngestor, create_sink
+from src.utils.compression import CompressionPolicy
+from src.utils.metrics import REGISTRY, start_metrics_server
+
+
+class GrpcCrashingAioServer(social_media_stream_pb2_grpc.SocialMediaStreamServiceServicer):
+
+    def __init__(self, recordings: RecordingStore = None, broadcasts: BroadcastHubRegistry = None,
+                 watch_stream_frames: int = None, response_cache: AsyncResponseCache = None):
+        self.recordings = recordings or RecordingStore()
+        self.broadcasts = broadcasts or BroadcastHubRegistry()
+        # downloadStream is idempotent, identical requests share one serialized response
+        self.response_cache = response_cache or AsyncResponseCache()
+        # a live stream never ends on its own, viewers get this many frames
+        self.watch_stream_frames = watch_stream_frames or int(os.environ.get('WATCH_STREAM_FRAMES', 3))
+        self.rooms = InteractRoomRegistry()
+
+    async def downloadStream(self, request, context):
+        log.debug('Received request to download stream from %s using quality %s', request.provider_name, request.quality)
+        return await self.response_cache.get_or_load((request.provider_name, request.quality),
+                                                     lambda: self._load_recording(request))
+
+    async def _load_recording(self, request) -> bytes:
+        return social_media_stream_pb2.Recording(data=b'Recording Data').SerializeToString()
+
+    async def downloadStreamChunked(self, request, context):
+        log.debug('Received request to download stream from %s using quality %s starting at %d',
+                  request.provider_name, request.quality, request.offset)
+        if request.offset < 0 or request.length < 0:
+            await context.abort(grpc.StatusCode.INVALID_ARGUMENT, 'Offset and length must not be negative')
+        with self.recordings.open(request.provider_name, request.quality) as recording:
+            if request.offset > recording.size:
+                await context.abort(grpc.StatusCode.OUT_OF_RANGE, f'Offset {request.offset} is past the end of the recording')
+            for chunk in recording.chunks(request.offset, request.length):
+                yield chunk
+
+    async def watchStream(self, request, context):
+        # viewers of the same provider share frames that the hub has serialized once
+        try:
+            async for frame in self.broadcasts.hub(request.provider_name).async_frames(self.watch_stream_frames):
+                yield frame
+        except BroadcastInterrupted as e:
+            await context.abort(grpc.StatusCode.UNAVAILABLE, str(e))
+        log.debug('Returned %d responses to watch stream...', self.watch_stream_frames)
+
+    async def startStream(self, request_iterator, context):
+        log.debug('Received request from client to start stream...')
+        ingestor = AsyncStreamIngestor(create_sink())
+        try:
+            try:
+                async for stream_update in async_unbatched(request_iterator):
+                    log.debug('Got audio and video from client stream: %s', stream_update)
+                    await ingestor.feed(stream_update)
+            except grpc.RpcError as e:
+                log.error('An error occurred while trying to get audio and video: %s', e)
+
+            summary = await ingestor.finish()
+        finally:
+            # a cancelled or failed upload still releases its sink
+            await ingestor.close()
+        log.debug('Client stream has finally ended...')
+
+        message = f'We got your words from the stream! {summary}'
+
+        return social_media_stream_pb2.StartStreamResponse(message=message)
+
+    async def joinInteractStream(self, request_iterator, context):
+        # requests arrive undecoded: rooms route them by peeking at the raw bytes and relay them as they are
+        log.debug('Received request to join interact stream...')
+        participant = Participant()
+        room = None
+
+        async def receive():
+            nonlocal room
+            try:
+                async for raw_message in request_iterator:
+                    # batches are relayed update by update, other participants may not understand batches
+                    for raw_update in raw_unbatched(raw_message):
+                        if room is None:
+                            room = self.rooms.join(raw_provider_name(raw_update), participant)
+                        if raw_audio_data(raw_update) == b'Hey':
+                            log.debug('Sending Hey during interact stream')
+                            participant.offer(GREETING_REPLY)
+                        room.relay(participant, raw_update)
+            except grpc.RpcError as e:
+                log.error('An error occurred while trying to get audio and video: %s', e)
+            finally:
+                participant.close()
+
+        receiver = asyncio.ensure_future(receive())
+        try:
+            async for payload in participant.messages():
+                yield payload
+            log.debug('Interact stream has finally ended...')
+            yield FAREWELL_REPLY
+        finally:
+            receiver.cancel()
+            if room is not None:
+                self.rooms.leave(room, participant)
+
+
+async def serve():
+    # metrics first, so shed calls are counted as well; calls failing the JWT check never reach a handler and are
+    # counted by grpc_server_auth_failures_total instead; excess unary calls are shed before their JWT is checked
+    interceptors = [AsyncMetricsServerInterceptor(REGISTRY), AsyncAdaptiveConcurrencyServerInterceptor(metrics=REGISTRY),
+                    grpc_server_aio_auth_interceptor.GrpcAsyncAuthServerInterceptor(metrics=REGISTRY),
+                    AsyncFaultInjectionServerInterceptor(FaultInjector.from_env(metrics=REGISTRY)),
+                    AsyncCompressionServerInterceptor(CompressionPolicy.from_env())]
+    if os.environ.get('METRICS_PORT'):
+        start_metrics_server(int(os.environ['METRICS_PORT']))
+    # no thread pool: every stream is a coroutine, so concurrency is bounded by memory rather than by workers
+    server = grpc.aio.server(interceptors=interceptors, options=[('grpc.so_reuseport', 1)])
+    servicer = GrpcCrashingAioServer(response_cache=AsyncResponseCache(metrics=REGISTRY, name='downloadStream'))
+    add_servicer_to_server(servicer, server, raw_request_methods=('joinInteractStream',))
+    server.add_secure_port('0.0.0.0:9030', create_server_credentials())
+    await server.start()
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM,
+                                                  lambda: asyncio.ensure_future(server.stop(SHUTDOWN_GRACE_S)))
+    await server.wait_for_termination()
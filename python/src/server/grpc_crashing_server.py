@@ -1,5 +1,7 @@
+import asyncio
 import logging as log
-import random
+import os
+import signal
 from concurrent import futures
 
 import grpc
@@ -7,90 +9,155 @@ import grpc
 from src.utils import credentials
 import social_media_stream_pb2
 import social_media_stream_pb2_grpc
-from src.client.grpc_data_utils import _from_proto_stream
 from src.interceptor import grpc_server_auth_interceptor
+from src.interceptor.grpc_server_compression_interceptor import CompressionServerInterceptor
+from src.interceptor.grpc_server_concurrency_limiter import AdaptiveConcurrencyServerInterceptor
+from src.interceptor.grpc_server_fault_injection import FaultInjectionServerInterceptor, FaultInjector
+from src.interceptor.grpc_server_metrics_interceptor import MetricsServerInterceptor
+from src.server.grpc_broadcast_hub import BroadcastHubRegistry, BroadcastInterrupted
+from src.server.grpc_recording_store import RecordingStore
+from src.server.grpc_response_cache import ResponseCache
+from src.server.grpc_service_handlers import add_servicer_to_server
+from src.server.grpc_stream_batches import unbatched
+from src.server.grpc_stream_sink import StreamIngestor, create_sink
+from src.utils.compression import CompressionPolicy
+from src.utils.metrics import REGISTRY, start_metrics_server
+
+
+# calls running when SIGTERM arrives get this long to finish
+SHUTDOWN_GRACE_S = 10
 
 
 class GrpcCrashingServer(social_media_stream_pb2_grpc.SocialMediaStreamServiceServicer):
 
-    @staticmethod
-    def random_failure(context):
-        if random.randint(0, 100) > 70:
-            context.set_code(random.choice([grpc.StatusCode.CANCELLED, grpc.StatusCode.UNAVAILABLE, grpc.StatusCode.DEADLINE_EXCEEDED]))
-            context.set_details('SIMULATION')
-            raise grpc.RpcError('RPC cancelled')
+    def __init__(self, recordings: RecordingStore = None, broadcasts: BroadcastHubRegistry = None,
+                 watch_stream_frames: int = None, response_cache: ResponseCache = None):
+        self.recordings = recordings or RecordingStore()
+        self.broadcasts = broadcasts or BroadcastHubRegistry()
+        # downloadStream is idempotent, identical requests share one serialized response
+        self.response_cache = response_cache or ResponseCache()
+        # a live stream never ends on its own, viewers get this many frames
+        self.watch_stream_frames = watch_stream_frames or int(os.environ.get('WATCH_STREAM_FRAMES', 3))
 
     def downloadStream(self, request, context):
-        log.info(f'Received request to download stream from {request.provider_name} using quality {request.quality}')
-        self.random_failure(context)
-        return social_media_stream_pb2.Recording(data=b'Recording Data')
+        log.debug('Received request to download stream from %s using quality %s', request.provider_name, request.quality)
+        return self.response_cache.get_or_load((request.provider_name, request.quality),
+                                               lambda: self._load_recording(request))
+
+    def _load_recording(self, request) -> bytes:
+        return social_media_stream_pb2.Recording(data=b'Recording Data').SerializeToString()
+
+    def downloadStreamChunked(self, request, context):
+        log.debug('Received request to download stream from %s using quality %s starting at %d',
+                  request.provider_name, request.quality, request.offset)
+        if request.offset < 0 or request.length < 0:
+            context.abort(grpc.StatusCode.INVALID_ARGUMENT, 'Offset and length must not be negative')
+        with self.recordings.open(request.provider_name, request.quality) as recording:
+            if request.offset > recording.size:
+                context.abort(grpc.StatusCode.OUT_OF_RANGE, f'Offset {request.offset} is past the end of the recording')
+            yield from recording.chunks(request.offset, request.length)
 
     def watchStream(self, request, context):
-        self.random_failure(context)
-        for i in range(3):
-            log.info(f'Returned response {i} to watch stream...')
-            yield social_media_stream_pb2.StreamUpdate(audio_chunk=social_media_stream_pb2.AudioChunk(audio_data=f'Audio{i}'.encode()),
-                                                       video_frame=social_media_stream_pb2.VideoFrame(frame_data=f'Video{i}'.encode()))
+        # viewers of the same provider share frames that the hub has serialized once
+        try:
+            yield from self.broadcasts.hub(request.provider_name).frames(self.watch_stream_frames, context.is_active)
+        except BroadcastInterrupted as e:
+            context.abort(grpc.StatusCode.UNAVAILABLE, str(e))
+        log.debug('Returned %d responses to watch stream...', self.watch_stream_frames)
 
     def startStream(self, request_iterator, context):
-        log.info('Received request from client to start stream...')
-        self.random_failure(context)
-        updates = []
+        log.debug('Received request from client to start stream...')
+        ingestor = StreamIngestor(create_sink())
         try:
-            for stream_update in request_iterator:
-                log.info(f'Got audio and video from client stream: {stream_update}')
-                updates.append(stream_update)
-        except grpc.RpcError as e:
-            log.error(f'An error occurred while trying to get audio and video: {e}')
-
-        log.info('Client stream has finally ended...')
+            try:
+                for stream_update in unbatched(request_iterator):
+                    log.debug('Got audio and video from client stream: %s', stream_update)
+                    ingestor.feed(stream_update)
+            except grpc.RpcError as e:
+                log.error('An error occurred while trying to get audio and video: %s', e)
+
+            summary = ingestor.finish()
+        finally:
+            # a cancelled or failed upload still releases its sink
+            ingestor.close()
+        log.debug('Client stream has finally ended...')
 
-        message = f'We got your words from the stream! They are:{updates}'
+        message = f'We got your words from the stream! {summary}'
 
         return social_media_stream_pb2.StartStreamResponse(message=message)
 
     def joinInteractStream(self, request_iterator, context):
-        log.info('Received request to join interact stream...')
-        self.random_failure(context)
+        log.debug('Received request to join interact stream...')
         try:
-            for stream_update in request_iterator:
-                log.info(f'Got audio and video from client during interact stream: {stream_update}')
-                if 'Hey' == _from_proto_stream(stream_update)[1]:
-                    log.info(f'Sending Hey during interact stream: {stream_update}')
+            for stream_update in unbatched(request_iterator):
+                log.debug('Got audio and video from client during interact stream: %s', stream_update)
+                if stream_update.audio_chunk.audio_data == b'Hey':
+                    log.debug('Sending Hey during interact stream')
                     yield social_media_stream_pb2.InteractStreamUpdate(
                         audio_chunk=social_media_stream_pb2.AudioChunk(audio_data=b'Hey! How are you doing?'),
                         video_frame=social_media_stream_pb2.VideoFrame(frame_data=b'ServerMuzzle')
                     )
         except grpc.RpcError as e:
-            log.error(f'An error occurred while trying to get audio and video: {e}')
+            log.error('An error occurred while trying to get audio and video: %s', e)
 
         finally:
-            log.info('Interact stream has finally ended...')
+            log.debug('Interact stream has finally ended...')
             yield social_media_stream_pb2.InteractStreamUpdate(
                 audio_chunk=social_media_stream_pb2.AudioChunk(audio_data=b'It was a pleasure talking to you. Bye!'),
                 video_frame=social_media_stream_pb2.VideoFrame(frame_data=b'ServerMuzzle')
             )
 
 
+def create_server_credentials():
+    key_file = credentials.server_certificate_key_file()
+    certificate_file = credentials.server_certificate_file()
+    loaded_versions = None
+
+    def fetch_certificate_configuration():
+        # grpc asks before every handshake, a new configuration is only handed out once a file has changed
+        nonlocal loaded_versions
+        key, certificate = key_file.read(), certificate_file.read()
+        versions = (key_file.version, certificate_file.version)
+        if versions == loaded_versions:
+            return None
+        loaded_versions = versions
+        return grpc.ssl_server_certificate_configuration(((key, certificate),))
+
+    return grpc.dynamic_ssl_server_credentials(fetch_certificate_configuration(), fetch_certificate_configuration)
+
+
 def serve():
-    interceptors = [grpc_server_auth_interceptor.GrpcAuthServerInterceptor()]
-    server = grpc.server(futures.ThreadPoolExecutor(max_workers=10), interceptors=interceptors)
-    # Loading credentials
-    server_credentials = grpc.ssl_server_credentials(
-        (
-            (
-                credentials.SERVER_CERTIFICATE_KEY,
-                credentials.SERVER_CERTIFICATE,
-            ),
-        )
-    )
-    # grpc allows both GZIP and no compression by default
-    social_media_stream_pb2_grpc.add_SocialMediaStreamServiceServicer_to_server(GrpcCrashingServer(), server)
-    server.add_secure_port('0.0.0.0:9030', server_credentials)
+    # metrics first, so shed calls are counted as well; calls failing the JWT check never reach a handler and are
+    # counted by grpc_server_auth_failures_total instead; excess unary calls are shed before their JWT is checked
+    interceptors = [MetricsServerInterceptor(REGISTRY), AdaptiveConcurrencyServerInterceptor(metrics=REGISTRY),
+                    grpc_server_auth_interceptor.GrpcAuthServerInterceptor(metrics=REGISTRY),
+                    FaultInjectionServerInterceptor(FaultInjector.from_env(metrics=REGISTRY)),
+                    CompressionServerInterceptor(CompressionPolicy.from_env())]
+    if os.environ.get('METRICS_PORT'):
+        start_metrics_server(int(os.environ['METRICS_PORT']))
+    # with SO_REUSEPORT every prefork worker can bind the same port
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=10), interceptors=interceptors,
+                         options=[('grpc.so_reuseport', 1)])
+    servicer = GrpcCrashingServer(response_cache=ResponseCache(metrics=REGISTRY, name='downloadStream'))
+    add_servicer_to_server(servicer, server)
+    server.add_secure_port('0.0.0.0:9030', create_server_credentials())
     server.start()
+    # k8s stops pods with SIGTERM: refuse new calls and let the running ones finish
+    signal.signal(signal.SIGTERM, lambda signum, frame: server.stop(SHUTDOWN_GRACE_S))
     server.wait_for_termination()
 
 
 if __name__ == '__main__':
     log.basicConfig(level=log.INFO, format='%(funcName)s - %(levelname)s - %(message)s')
-    serve()
+    # SERVER_MODE=aio serves every stream as a coroutine on a single event loop instead of a 10-thread pool
+    aio = os.environ.get('SERVER_MODE') == 'aio'
+    # SERVER_WORKERS > 1 runs that many server processes on the same port, one GIL each
+    workers = int(os.environ.get('SERVER_WORKERS', 1))
+    if workers > 1:
+        from src.server.grpc_prefork_server import PreforkSupervisor
+        PreforkSupervisor(workers, aio=aio, shutdown_timeout_s=SHUTDOWN_GRACE_S + 5).run()
+    elif aio:
+        from src.server import grpc_crashing_aio_server
+        asyncio.run(grpc_crashing_aio_server.serve())
+    else:
+        serve()
@@ -0,0 +1,160 @@
+import asyncio
+from typing import AsyncIterator, Dict, Iterator, Optional, Tuple
+
+import social_media_stream_pb2
+
+# InteractStreamUpdate field numbers, see proto/social-media-stream.proto
+_PROVIDER_NAME_FIELD = 1
+_AUDIO_CHUNK_FIELD = 3
+_BATCHED_UPDATES_FIELD = 4
+_AUDIO_DATA_FIELD = 1
+
+_VARINT = 0
+_FIXED64 = 1
+_LENGTH_DELIMITED = 2
+_FIXED32 = 5
+
+
+def _read_varint(buffer: memoryview, position: int) -> Tuple[int, int]:
+    value = shift = 0
+    while True:
+        byte = buffer[position]
+        position += 1
+        value |= (byte & 0x7f) << shift
+        if not byte & 0x80:
+            return value, position
+        shift += 7
+
+
+def _length_delimited_fields(buffer: memoryview) -> Iterator[Tuple[int, memoryview]]:
+    # walks the top level of a serialized message without building any Python objects for it
+    position = 0
+    while position < len(buffer):
+        key, position = _read_varint(buffer, position)
+        wire_type = key & 0x7
+        if wire_type == _LENGTH_DELIMITED:
+            length, position = _read_varint(buffer, position)
+            yield key >> 3, buffer[position:position + length]
+            position += length
+        elif wire_type == _VARINT:
+            _, position = _read_varint(buffer, position)
+        elif wire_type == _FIXED64:
+            position += 8
+        elif wire_type == _FIXED32:
+            position += 4
+        else:
+            raise ValueError(f'Unsupported wire type {wire_type}')
+
+
+def _field(buffer: memoryview, field_number: int) -> Optional[memoryview]:
+    for number, value in _length_delimited_fields(buffer):
+        if number == field_number:
+            return value
+    return None
+
+
+def raw_provider_name(raw_update: bytes) -> bytes:
+    provider_name = _field(memoryview(raw_update), _PROVIDER_NAME_FIELD)
+    return b'' if provider_name is None else provider_name.tobytes()
+
+
+def raw_audio_data(raw_update: bytes) -> memoryview:
+    audio_chunk = _field(memoryview(raw_update), _AUDIO_CHUNK_FIELD)
+    audio_data = None if audio_chunk is None else _field(audio_chunk, _AUDIO_DATA_FIELD)
+    return memoryview(b'') if audio_data is None else audio_data
+
+
+def raw_unbatched(raw_update: bytes) -> Iterator[bytes]:
+    """
+    Yields the serialized updates of a batch, or the update itself when it is not a batch.
+    """
+    batched = False
+    for number, value in _length_delimited_fields(memoryview(raw_update)):
+        if number == _BATCHED_UPDATES_FIELD:
+            batched = True
+            yield value.tobytes()
+    if not batched:
+        yield raw_update
+
+
+_END_OF_STREAM = object()
+
+
+class Participant:
+
+    def __init__(self, max_pending_messages: int = 64):
+        # unbounded, offer() enforces the limit so that close() can always enqueue the end of the stream
+        self.queue = asyncio.Queue()
+        self.max_pending_messages = max_pending_messages
+        self.dropped_messages = 0
+        self.closed = False
+
+    def offer(self, payload: bytes):
+        # a participant that does not keep up loses its oldest messages, the room never waits for it
+        if self.closed:
+            return
+        if self.queue.qsize() >= self.max_pending_messages:
+            self.queue.get_nowait()
+            self.dropped_messages += 1
+        self.queue.put_nowait(payload)
+
+    def close(self):
+        # nothing is offered after the end of the stream, so it is never dropped
+        if not self.closed:
+            self.closed = True
+            self.queue.put_nowait(_END_OF_STREAM)
+
+    async def messages(self) -> AsyncIterator[bytes]:
+        """
+        Yields the messages offered to the participant until it is closed.
+        """
+        while True:
+            payload = await self.queue.get()
+            if payload is _END_OF_STREAM:
+                return
+            yield payload
+
+
+class InteractRoom:
+
+    def __init__(self, name: bytes):
+        self.name = name
+        self.participants = set()
+
+    def relay(self, sender: Participant, raw_update: bytes):
+        for participant in self.participants:
+            if participant is not sender:
+                participant.offer(raw_update)
+
+
+class InteractRoomRegistry:
+    """
+    Rooms keyed by the raw `provider_name` of the first message a participant sends.
+    Lives on the event loop thread, so no locking is needed.
+    """
+
+    def __init__(self):
+        self.rooms: Dict[bytes, InteractRoom] = {}
+
+    def join(self, name: bytes, participant: Participant) -> InteractRoom:
+        room = self.rooms.get(name)
+        if room is None:
+            room = self.rooms[name] = InteractRoom(name)
+        room.participants.add(participant)
+        return room
+
+    def leave(self, room: InteractRoom, participant: Participant):
+        room.participants.discard(participant)
+        if not room.participants:
+            self.rooms.pop(room.name, None)
+
+
+GREETING_REPLY = social_media_stream_pb2.InteractStreamUpdate(
+    audio_chunk=social_media_stream_pb2.AudioChunk(audio_data=b'Hey! How are you doing?'),
+    video_frame=social_media_stream_pb2.VideoFrame(frame_data=b'ServerMuzzle')
+).SerializeToString()
+
+FAREWELL_REPLY = social_media_stream_pb2.InteractStreamUpdate(
+    audio_chunk=social_media_stream_pb2.AudioChunk(audio_data=b'It was a pleasure talking to you. Bye!'),
+    video_frame=social_media_stream_pb2.VideoFrame(frame_data=b'ServerMuzzle')
+).SerializeToString()
@@ -0,0 +1,94 @@
+import asyncio
+import logging as log
+import multiprocessing
+import os
+import signal
+import time
+from multiprocessing import connection
+
+# a worker that keeps crashing is restarted at most this often
+RESTART_DELAY_S = 1
+
+
+def _worker_main(index: int, aio: bool):
+    # runs in a freshly spawned interpreter, no grpc state is inherited from the supervisor
+    log.basicConfig(level=log.INFO, format=f'worker-{index} - %(funcName)s - %(levelname)s - %(message)s')
+    # Ctrl+C reaches the whole process group, the supervisor turns it into an orderly SIGTERM
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    metrics_port = os.environ.get('METRICS_PORT')
+    if metrics_port:
+        # only one process can bind the metrics port, every worker gets its own
+        os.environ['METRICS_PORT'] = str(int(metrics_port) + index)
+    if aio:
+        from src.server import grpc_crashing_aio_server
+        asyncio.run(grpc_crashing_aio_server.serve())
+    else:
+        from src.server import grpc_crashing_server
+        grpc_crashing_server.serve()
+
+
+class PreforkSupervisor:
+    """
+    Runs the server in several processes, each with its own GIL and its own grpc server bound to the same port
+    through SO_REUSEPORT, so the kernel spreads connections over all of them. Crashed workers are restarted;
+    SIGTERM or SIGINT stops every worker gracefully.
+    """
+
+    def __init__(self, workers: int, aio: bool = False, shutdown_timeout_s: float = 15):
+        """
+        :param shutdown_timeout_s: how long workers may take to drain before they are killed
+        """
+        self._workers = workers
+        self._aio = aio
+        self._shutdown_timeout_s = shutdown_timeout_s
+        # spawn rather than fork: grpc does not survive a fork once its core is initialised
+        self._context = multiprocessing.get_context('spawn')
+        self._processes = {}
+        self._restart_at = {}
+        self._stopping = False
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, self._stop)
+        for index in range(self._workers):
+            self._start(index)
+        while not self._stopping:
+            connection.wait([process.sentinel for process in self._processes.values()], timeout=RESTART_DELAY_S)
+            self._restart_exited()
+        self._shutdown()
+
+    def _start(self, index: int):
+        process = self._context.Process(target=_worker_main, args=(index, self._aio), name=f'grpc-worker-{index}')
+        process.start()
+        self._processes[index] = process
+        self._restart_at[index] = time.monotonic() + RESTART_DELAY_S
+        log.info('Started worker %d with pid %d', index, process.pid)
+
+    def _restart_exited(self):
+        for index, process in list(self._processes.items()):
+            if process.is_alive() or self._stopping:
+                continue
+            if time.monotonic() < self._restart_at[index]:
+                # it crashed right after starting, wait a little before trying again
+                continue
+            log.warning('Worker %d with pid %d exited with code %s, restarting it', index, process.pid,
+                        process.exitcode)
+            process.close()
+            self._start(index)
+
+    def _stop(self, signum, frame):
+        log.info('Received %s, stopping workers...', signal.Signals(signum).name)
+        self._stopping = True
+
+    def _shutdown(self):
+        for process in self._processes.values():
+            if process.is_alive():
+                process.terminate()
+        deadline = time.monotonic() + self._shutdown_timeout_s
+        for index, process in self._processes.items():
+            process.join(max(deadline - time.monotonic(), 0))
+            if process.is_alive():
+                log.warning('Worker %d did not stop in time, killing it', index)
+                process.kill()
+                process.join()
+        log.info('All workers stopped')
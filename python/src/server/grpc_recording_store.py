@@ -0,0 +1,64 @@
+import mmap
+import os
+import re
+
+import social_media_stream_pb2
+
+DEFAULT_RECORDING = b'Recording Data'
+CHUNK_SIZE = 64 * 1024
+
+
+class Recording:
+    """
+    A recording file mapped into memory, so chunks are sliced straight from the page cache
+    instead of reading the whole file into the process.
+    """
+
+    def __init__(self, path: str = None):
+        self._file = None
+        self._data = DEFAULT_RECORDING
+        if path is not None:
+            self._file = open(path, 'rb')
+            if os.fstat(self._file.fileno()).st_size:
+                self._data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                self._data = b''
+
+    @property
+    def size(self) -> int:
+        return len(self._data)
+
+    def chunks(self, offset: int, length: int = 0, chunk_size: int = CHUNK_SIZE):
+        if offset < 0 or length < 0:
+            raise ValueError(f'Offset {offset} and length {length} must not be negative')
+        end = self.size if not length else min(offset + length, self.size)
+        for chunk_offset in range(offset, end, chunk_size):
+            yield social_media_stream_pb2.RecordingChunk(data=self._data[chunk_offset:min(chunk_offset + chunk_size, end)],
+                                                         offset=chunk_offset, total_size=self.size)
+
+    def close(self):
+        if isinstance(self._data, mmap.mmap):
+            self._data.close()
+        if self._file is not None:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class RecordingStore:
+
+    def __init__(self, directory: str = None):
+        # RECORDINGS_DIR holds `<provider_name>_<quality>.rec` files, without it every provider serves the demo recording
+        self.directory = directory or os.environ.get('RECORDINGS_DIR')
+
+    def open(self, provider_name: str, quality: str) -> Recording:
+        if self.directory:
+            name = re.sub(r'[^\w.-]', '_', f'{provider_name}_{quality}.rec')
+            path = os.path.join(self.directory, name)
+            if os.path.isfile(path):
+                return Recording(path)
+        return Recording()
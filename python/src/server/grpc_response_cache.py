@@ -0,0 +1,145 @@
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+from concurrent import futures
+from typing import Awaitable, Callable, Hashable, Optional
+
+from src.utils.metrics import MetricsRegistry
+
+
+class _Entries:
+    # least recently used first; an entry older than the ttl counts as missing
+
+    def __init__(self, max_entries: int, max_bytes: int, ttl_s: float):
+        self._max_entries = max_entries
+        self._max_bytes = max_bytes
+        self._ttl_s = ttl_s
+        self._entries = OrderedDict()
+        self._bytes = 0
+
+    def get(self, key) -> Optional[bytes]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        payload, expires_at = entry
+        if time.monotonic() >= expires_at:
+            self._remove(key)
+            return None
+        self._entries.move_to_end(key)
+        return payload
+
+    def put(self, key, payload: bytes):
+        if len(payload) > self._max_bytes:
+            return
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (payload, time.monotonic() + self._ttl_s)
+        self._bytes += len(payload)
+        while len(self._entries) > self._max_entries or self._bytes > self._max_bytes:
+            self._remove(next(iter(self._entries)))
+
+    def _remove(self, key):
+        payload, _ = self._entries.pop(key)
+        self._bytes -= len(payload)
+
+
+class _CacheMetrics:
+
+    def __init__(self, metrics: Optional[MetricsRegistry], name: str):
+        self._counters = {}
+        if metrics is not None:
+            for outcome in ('hit', 'miss', 'coalesced'):
+                self._counters[outcome] = metrics.counter('grpc_server_response_cache_total',
+                                                          'Lookups of the response cache by outcome',
+                                                          cache=name, outcome=outcome)
+
+    def count(self, outcome: str):
+        counter = self._counters.get(outcome)
+        if counter is not None:
+            counter.inc()
+
+
+class ResponseCache:
+    """
+    Serialized responses of idempotent calls, evicted least recently used first once `max_entries` or `max_bytes`
+    is exceeded, and after `ttl_s` seconds at the latest. Identical requests arriving while a response is being
+    produced wait for that one instead of producing their own (single flight), so a burst of identical calls
+    costs one load. Failed loads are not cached, every waiting caller gets the error.
+    """
+
+    def __init__(self, max_entries: int = 1024, max_bytes: int = 64 * 1024 * 1024, ttl_s: float = 30,
+                 metrics: Optional[MetricsRegistry] = None, name: str = 'default'):
+        self._entries = _Entries(max_entries, max_bytes, ttl_s)
+        self._lock = threading.Lock()
+        self._in_flight = {}
+        self._metrics = _CacheMetrics(metrics, name)
+
+    def get_or_load(self, key: Hashable, load: Callable[[], bytes]) -> bytes:
+        with self._lock:
+            payload = self._entries.get(key)
+            if payload is not None:
+                self._metrics.count('hit')
+                return payload
+            flight = self._in_flight.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._in_flight[key] = futures.Future()
+        if not leader:
+            self._metrics.count('coalesced')
+            return flight.result()
+
+        self._metrics.count('miss')
+        try:
+            payload = load()
+        except BaseException as e:
+            with self._lock:
+                del self._in_flight[key]
+            flight.set_exception(e)
+            raise
+        with self._lock:
+            self._entries.put(key, payload)
+            del self._in_flight[key]
+        flight.set_result(payload)
+        return payload
+
+
+def _consume_exception(flight: asyncio.Future):
+    # a load whose callers were all cancelled would otherwise log "Task exception was never retrieved"
+    if not flight.cancelled():
+        flight.exception()
+
+
+class AsyncResponseCache:
+    """
+    ResponseCache for grpc.aio servers. Lives on the event loop thread, so no locking is needed. The load runs as a
+    task of its own, a caller that is cancelled while waiting does not cancel it for the others.
+    """
+
+    def __init__(self, max_entries: int = 1024, max_bytes: int = 64 * 1024 * 1024, ttl_s: float = 30,
+                 metrics: Optional[MetricsRegistry] = None, name: str = 'default'):
+        self._entries = _Entries(max_entries, max_bytes, ttl_s)
+        self._in_flight = {}
+        self._metrics = _CacheMetrics(metrics, name)
+
+    async def get_or_load(self, key: Hashable, load: Callable[[], Awaitable[bytes]]) -> bytes:
+        payload = self._entries.get(key)
+        if payload is not None:
+            self._metrics.count('hit')
+            return payload
+        flight = self._in_flight.get(key)
+        if flight is None:
+            self._metrics.count('miss')
+            flight = self._in_flight[key] = asyncio.ensure_future(self._load(key, load))
+            flight.add_done_callback(_consume_exception)
+        else:
+            self._metrics.count('coalesced')
+        return await asyncio.shield(flight)
+
+    async def _load(self, key, load):
+        try:
+            payload = await load()
+            self._entries.put(key, payload)
+            return payload
+        finally:
+            del self._in_flight[key]
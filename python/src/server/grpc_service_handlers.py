@@ -0,0 +1,56 @@
+import grpc
+
+import social_media_stream_pb2
+
+SERVICE_NAME = 'SocialMediaStreamService'
+
+
+def _serialize(message):
+    # handlers may hand out frames that were already serialized once for many callers
+    if isinstance(message, bytes):
+        return message
+    return message.SerializeToString()
+
+
+def _raw(payload):
+    return payload
+
+
+def add_servicer_to_server(servicer, server, raw_request_methods=()):
+    """
+    Same handlers as the generated `add_SocialMediaStreamServiceServicer_to_server`,
+    except that responses may also be pre-serialized `bytes`.
+    :param raw_request_methods: methods whose requests are handed to the servicer as undecoded `bytes`
+    """
+
+    def deserializer(method, message_type):
+        return _raw if method in raw_request_methods else message_type.FromString
+
+    rpc_method_handlers = {
+        'downloadStream': grpc.unary_unary_rpc_method_handler(
+            servicer.downloadStream,
+            request_deserializer=deserializer('downloadStream', social_media_stream_pb2.WatchStreamRequest),
+            response_serializer=_serialize,
+        ),
+        'watchStream': grpc.unary_stream_rpc_method_handler(
+            servicer.watchStream,
+            request_deserializer=deserializer('watchStream', social_media_stream_pb2.WatchStreamRequest),
+            response_serializer=_serialize,
+        ),
+        'startStream': grpc.stream_unary_rpc_method_handler(
+            servicer.startStream,
+            request_deserializer=deserializer('startStream', social_media_stream_pb2.StreamUpdate),
+            response_serializer=_serialize,
+        ),
+        'joinInteractStream': grpc.stream_stream_rpc_method_handler(
+            servicer.joinInteractStream,
+            request_deserializer=deserializer('joinInteractStream', social_media_stream_pb2.InteractStreamUpdate),
+            response_serializer=_serialize,
+        ),
+        'downloadStreamChunked': grpc.unary_stream_rpc_method_handler(
+            servicer.downloadStreamChunked,
+            request_deserializer=deserializer('downloadStreamChunked', social_media_stream_pb2.DownloadChunkRequest),
+            response_serializer=_serialize,
+        ),
+    }
+    server.add_generic_rpc_handlers((grpc.method_handlers_generic_handler(SERVICE_NAME, rpc_method_handlers),))
@@ -0,0 +1,21 @@
+from typing import AsyncIterator, Iterator
+
+
+def unbatched(request_iterator: Iterator) -> Iterator:
+    """
+    Yields the updates of a client stream one by one, whether the client sent them one by one or in batches.
+    """
+    for update in request_iterator:
+        if update.batched_updates:
+            yield from update.batched_updates
+        else:
+            yield update
+
+
+async def async_unbatched(request_iterator: AsyncIterator) -> AsyncIterator:
+    async for update in request_iterator:
+        if update.batched_updates:
+            for batched_update in update.batched_updates:
+                yield batched_update
+        else:
+            yield update
@@ -0,0 +1,227 @@
+import abc
+import asyncio
+import collections
+import functools
+import os
+import tempfile
+import threading
+import uuid
+import zlib
+from concurrent import futures
+from typing import NamedTuple
+
+
+class StreamSink(abc.ABC):
+    # whether writes may block on I/O, the aio server then runs them off the event loop
+    blocking = False
+
+    @abc.abstractmethod
+    def write(self, data: bytes):
+        """
+        Consumes one chunk of a frame. The chunk must not be kept after the call returns.
+        """
+
+    def close(self):
+        pass
+
+
+class AppendOnlyFileSink(StreamSink):
+    blocking = True
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, 'ab')
+
+    def write(self, data: bytes):
+        self._file.write(data)
+
+    def close(self):
+        self._file.close()
+
+
+class RingBufferSink(StreamSink):
+    """
+    Keeps only the last `capacity` bytes of the stream in a preallocated buffer, memory never grows.
+    """
+
+    def __init__(self, capacity: int = 1 << 20):
+        self._buffer = memoryview(bytearray(capacity))
+        self._capacity = capacity
+        self._position = 0
+
+    def write(self, data: bytes):
+        data = memoryview(data)[-self._capacity:]
+        head = min(len(data), self._capacity - self._position)
+        self._buffer[self._position:self._position + head] = data[:head]
+        self._buffer[:len(data) - head] = data[head:]
+        self._position = (self._position + len(data)) % self._capacity
+
+
+def create_sink() -> StreamSink:
+    # STREAM_SINK=file keeps whole uploads on disk, the default ring buffer only keeps the tail in memory
+    if os.environ.get('STREAM_SINK') == 'file':
+        directory = os.environ.get('STREAM_SINK_DIR', tempfile.gettempdir())
+        return AppendOnlyFileSink(os.path.join(directory, f'stream-{uuid.uuid4().hex}.bin'))
+    return RingBufferSink()
+
+
+class StreamSummary(NamedTuple):
+    frames: int
+    bytes: int
+    checksum: int
+
+    def __str__(self):
+        return f'frames={self.frames}, bytes={self.bytes}, crc32={self.checksum:08x}'
+
+
+class _Accumulator:
+
+    def __init__(self, sink: StreamSink):
+        self.sink = sink
+        self.frames = 0
+        self.bytes = 0
+        self.checksum = 0
+        self._closed = False
+
+    def consume(self, stream_update):
+        self.frames += 1
+        for chunk in (stream_update.video_frame.frame_data, stream_update.audio_chunk.audio_data):
+            self.sink.write(chunk)
+            self.bytes += len(chunk)
+            self.checksum = zlib.crc32(chunk, self.checksum)
+
+    def close(self):
+        if not self._closed:
+            self._closed = True
+            self.sink.close()
+
+    def summary(self) -> StreamSummary:
+        return StreamSummary(self.frames, self.bytes, self.checksum)
+
+
+# uploads share these threads, each one is drained by at most one of them at a time so its frames stay in order
+_WRITERS = futures.ThreadPoolExecutor(max_workers=16, thread_name_prefix='stream-writer')
+
+
+class StreamIngestor:
+    """
+    Hands frames to a sink on a shared pool of writer threads through a bounded buffer.
+    `feed` blocks once the buffer is full, the handler then stops reading and gRPC flow control slows the client down.
+    Once the sink fails, `feed` and `finish` raise its error. `close` releases the sink of a stream that ended early.
+    """
+
+    def __init__(self, sink: StreamSink, max_pending_frames: int = 64, writers: futures.Executor = _WRITERS):
+        self._accumulator = _Accumulator(sink)
+        self._max_pending_frames = max_pending_frames
+        self._writers = writers
+        self._pending = collections.deque()
+        self._condition = threading.Condition()
+        self._writing = False
+        self._error = None
+
+    def _drain(self):
+        while True:
+            with self._condition:
+                if not self._pending or self._error is not None:
+                    self._writing = False
+                    self._condition.notify_all()
+                    return
+                stream_update = self._pending.popleft()
+                self._condition.notify_all()
+            try:
+                self._accumulator.consume(stream_update)
+            except Exception as e:
+                with self._condition:
+                    self._error = e
+                    self._pending.clear()
+
+    def _raise_error(self):
+        if self._error is not None:
+            raise self._error
+
+    def feed(self, stream_update):
+        with self._condition:
+            while len(self._pending) >= self._max_pending_frames and self._error is None:
+                self._condition.wait()
+            self._raise_error()
+            self._pending.append(stream_update)
+            if not self._writing:
+                self._writing = True
+                self._writers.submit(self._drain)
+
+    def _wait_written(self):
+        with self._condition:
+            while self._writing:
+                self._condition.wait()
+
+    def finish(self) -> StreamSummary:
+        try:
+            self._wait_written()
+            self._raise_error()
+            return self._accumulator.summary()
+        finally:
+            self._accumulator.close()
+
+    def close(self):
+        with self._condition:
+            self._pending.clear()
+        self._wait_written()
+        self._accumulator.close()
+
+
+_END_OF_STREAM = object()
+
+
+class AsyncStreamIngestor:
+    """
+    StreamIngestor for grpc.aio servers. Writes of blocking sinks run in a thread, so a slow disk slows the client down
+    instead of stalling the event loop.
+    """
+
+    def __init__(self, sink: StreamSink, max_pending_frames: int = 64):
+        self._accumulator = _Accumulator(sink)
+        self._blocking = sink.blocking
+        self._queue = asyncio.Queue(maxsize=max_pending_frames)
+        self._error = None
+        self._discarding = False
+        self._writer = asyncio.ensure_future(self._drain())
+
+    async def _run(self, function, *args):
+        if self._blocking:
+            return await asyncio.get_running_loop().run_in_executor(None, functools.partial(function, *args))
+        return function(*args)
+
+    async def _drain(self):
+        while True:
+            stream_update = await self._queue.get()
+            if stream_update is _END_OF_STREAM:
+                return
+            # after a failure or close() frames are only taken off the queue, so feed never waits forever
+            if self._error is None and not self._discarding:
+                try:
+                    await self._run(self._accumulator.consume, stream_update)
+                except Exception as e:
+                    self._error = e
+
+    def _raise_error(self):
+        if self._error is not None:
+            raise self._error
+
+    async def feed(self, stream_update):
+        self._raise_error()
+        await self._queue.put(stream_update)
+
+    async def _stop(self):
+        if not self._writer.done():
+            await self._queue.put(_END_OF_STREAM)
+            await self._writer
+        await self._run(self._accumulator.close)
+
+    async def finish(self) -> StreamSummary:
+        await self._stop()
+        self._raise_error()
+        return self._accumulator.summary()
+
+    async def close(self):
+        self._discarding = True
+        await self._stop()
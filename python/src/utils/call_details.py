@@ -0,0 +1,22 @@
+import collections
+
+import grpc
+
+
+class _ClientCallDetails(
+    collections.namedtuple('_ClientCallDetails',
+                           ('method', 'timeout', 'metadata', 'credentials', 'wait_for_ready', 'compression')),
+    grpc.ClientCallDetails
+):
+    pass
+
+
+def replace_call_details(call_details, **changes):
+    """
+    Copies sync or aio client call details with some of their fields changed.
+    """
+    if isinstance(call_details, grpc.aio.ClientCallDetails):
+        return call_details._replace(**changes)
+    fields = {field: getattr(call_details, field, None) for field in _ClientCallDetails._fields}
+    fields.update(changes)
+    return _ClientCallDetails(**fields)
@@ -0,0 +1,87 @@
+import os
+import zlib
+
+import grpc
+
+from src.utils.rpc_metrics import message_size
+
+ALGORITHMS = {
+    'none': grpc.Compression.NoCompression,
+    'deflate': grpc.Compression.Deflate,
+    'gzip': grpc.Compression.Gzip,
+}
+
+
+class _Sampling:
+
+    def __init__(self):
+        self.messages = 0
+        self.compressible = False
+
+
+class CompressionPolicy:
+    """
+    Decides per message whether compressing it is worth the CPU. Messages below `min_size_bytes` are sent as they are,
+    since framing dwarfs what compression could save. For larger ones a slice of every `sample_every`-th message of a
+    method is compressed with the cheapest zlib level, and the method's messages are only compressed while that sample
+    shrinks to `max_ratio` or less. Encoded video and audio do not shrink, so they skip compression after one sample.
+    """
+
+    def __init__(self, algorithm: grpc.Compression = grpc.Compression.Deflate, *, min_size_bytes: int = 1024,
+                 max_ratio: float = 0.9, sample_bytes: int = 4096, sample_every: int = 64):
+        """
+        :param algorithm: used for messages worth compressing, NoCompression turns compression off
+        :param min_size_bytes: smaller messages are never compressed
+        :param max_ratio: compressed to uncompressed size of the sample at which compression starts to pay off
+        :param sample_bytes: size of the slice compressed to estimate compressibility
+        :param sample_every: how many messages of a method reuse one estimate
+        """
+        self.algorithm = algorithm
+        self._min_size_bytes = min_size_bytes
+        self._max_ratio = max_ratio
+        self._sample_bytes = sample_bytes
+        self._sample_every = sample_every
+        # unsynchronised on purpose: a lost update only means one sample more or less
+        self._methods = {}
+
+    @classmethod
+    def from_env(cls, **options) -> 'CompressionPolicy':
+        """
+        Policy with the algorithm named by the COMPRESSION environment variable: none, deflate (default) or gzip.
+        """
+        return cls(ALGORITHMS[os.environ.get('COMPRESSION', 'deflate').lower()], **options)
+
+    @property
+    def enabled(self) -> bool:
+        return self.algorithm != grpc.Compression.NoCompression
+
+    def choose(self, method: str, message) -> grpc.Compression:
+        """
+        :return: the compression for this message of `method`
+        """
+        size = message_size(message)
+        if not self.enabled or size < self._min_size_bytes:
+            return grpc.Compression.NoCompression
+        sampling = self._methods.get(method)
+        if sampling is None:
+            sampling = self._methods.setdefault(method, _Sampling())
+        if sampling.messages % self._sample_every == 0:
+            sampling.compressible = self._is_compressible(message, size)
+        sampling.messages += 1
+        return self.algorithm if sampling.compressible else grpc.Compression.NoCompression
+
+    def last_choice(self, method: str) -> grpc.Compression:
+        """
+        :return: the compression of the latest sampled message of `method`, for calls whose messages are not known yet
+        """
+        sampling = self._methods.get(method)
+        if not self.enabled or sampling is None or not sampling.compressible:
+            return grpc.Compression.NoCompression
+        return self.algorithm
+
+    def _is_compressible(self, message, size: int) -> bool:
+        serialized = message if isinstance(message, bytes) else message.SerializeToString()
+        # field tags and short fields sit at the start, the middle is the payload
+        start = max(0, (size - self._sample_bytes) // 2)
+        sample = serialized[start:start + self._sample_bytes]
+        return len(zlib.compress(sample, 1)) <= len(sample) * self._max_ratio
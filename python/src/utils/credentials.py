@@ -1,17 +1,69 @@
 import os
+import threading
 
 
-def _load_credential_from_file(filepath):
-    real_path = os.path.join(os.path.dirname(__file__), filepath)
-    with open(real_path, "rb") as f:
-        return f.read()
+class CredentialFile:
+    """
+    Contents of a key or certificate file, read on first use and read again whenever the file's modification time
+    changes, so rotated certificates are picked up without a restart.
+    """
 
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._mtime_ns = None
+        self._contents = None
+        self.version = 0
 
-server_host = os.environ.get("SERVER_HOST")
+    def read(self) -> bytes:
+        mtime_ns = os.stat(self.path).st_mtime_ns
+        if mtime_ns != self._mtime_ns:
+            with self._lock:
+                if mtime_ns != self._mtime_ns:
+                    with open(self.path, 'rb') as f:
+                        self._contents = f.read()
+                    self._mtime_ns = mtime_ns
+                    self.version += 1
+        return self._contents
 
-if server_host == "localhost":
-    SERVER_CERTIFICATE_KEY = _load_credential_from_file(f"../../../tls_credentials/{server_host}.key")
-    SERVER_CERTIFICATE = _load_credential_from_file(f"../../../tls_credentials/{server_host}.crt")
-else:
-    SERVER_CERTIFICATE_KEY = _load_credential_from_file(f"../../tls_credentials/{server_host}.key")
-    SERVER_CERTIFICATE = _load_credential_from_file(f"../../tls_credentials/{server_host}.crt")
+
+def _credentials_dir(server_host):
+    # locally the repository root holds tls_credentials, in the image it is copied next to the sources
+    relative_dir = '../../../tls_credentials' if server_host == 'localhost' else '../../tls_credentials'
+    return os.path.join(os.path.dirname(__file__), relative_dir)
+
+
+_files = {}
+_files_lock = threading.Lock()
+
+
+def _credential_file(extension: str) -> CredentialFile:
+    server_host = os.environ.get('SERVER_HOST')
+    path = os.path.join(_credentials_dir(server_host), f'{server_host}.{extension}')
+    credential_file = _files.get(path)
+    if credential_file is None:
+        with _files_lock:
+            credential_file = _files.setdefault(path, CredentialFile(path))
+    return credential_file
+
+
+def server_certificate_file() -> CredentialFile:
+    return _credential_file('crt')
+
+
+def server_certificate_key_file() -> CredentialFile:
+    return _credential_file('key')
+
+
+_ATTRIBUTES = {
+    'SERVER_CERTIFICATE': server_certificate_file,
+    'SERVER_CERTIFICATE_KEY': server_certificate_key_file,
+}
+
+
+def __getattr__(name):
+    # keeps `credentials.SERVER_CERTIFICATE` working while nothing is read from disk at import time
+    credential_file = _ATTRIBUTES.get(name)
+    if credential_file is None:
+        raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+    return credential_file().read()
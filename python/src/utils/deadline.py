@@ -0,0 +1,38 @@
+import time
+from typing import Optional
+
+from src.utils.call_details import replace_call_details
+
+
+class Deadline:
+    """
+    The point in time by which the caller wants an answer, shared by every attempt of one call.
+    Retries and hedges give each attempt only the time that remains, which grpc sends on to the server
+    as its `grpc-timeout`, so no attempt outlives the caller's budget.
+    """
+
+    def __init__(self, timeout_s: Optional[float]):
+        self._expires_at = None if timeout_s is None else time.monotonic() + timeout_s
+
+    def remaining(self) -> Optional[float]:
+        """
+        :return: seconds left, None when the call has no deadline
+        """
+        if self._expires_at is None:
+            return None
+        return max(self._expires_at - time.monotonic(), 0.0)
+
+    def allows(self, delay_s: float) -> bool:
+        """
+        :return: whether there is still time left after waiting `delay_s`
+        """
+        remaining = self.remaining()
+        return remaining is None or delay_s < remaining
+
+    def attempt_details(self, call_details):
+        """
+        :return: a copy of sync or aio call details whose timeout is the remaining time
+        """
+        if self._expires_at is None:
+            return call_details
+        return replace_call_details(call_details, timeout=self.remaining())
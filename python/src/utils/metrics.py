@@ -0,0 +1,152 @@
+import bisect
+import itertools
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Tuple
+
+_STRIPES = 16
+
+# seconds, close to the Prometheus client defaults with more resolution below 10ms
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SIZE_BUCKETS = (64, 256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+
+_thread_stripe = threading.local()
+_next_stripe = itertools.count()
+
+
+def _stripe() -> int:
+    # threads take the stripes in turn, so up to _STRIPES threads never wait for the same lock
+    try:
+        return _thread_stripe.index
+    except AttributeError:
+        _thread_stripe.index = next(_next_stripe) % _STRIPES
+        return _thread_stripe.index
+
+
+class Counter:
+
+    def __init__(self):
+        self._locks = [threading.Lock() for _ in range(_STRIPES)]
+        self._cells = [0] * _STRIPES
+
+    def inc(self, amount=1):
+        stripe = _stripe()
+        with self._locks[stripe]:
+            self._cells[stripe] += amount
+
+    @property
+    def value(self):
+        return sum(self._cells)
+
+
+class Gauge:
+
+    def __init__(self):
+        self.value = 0
+
+    def set(self, value):
+        self.value = value
+
+
+class Histogram:
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self._locks = [threading.Lock() for _ in range(_STRIPES)]
+        # per stripe: one cell per bucket, one for +Inf, then the sum
+        self._cells = [[0] * (len(buckets) + 2) for _ in range(_STRIPES)]
+
+    def observe(self, value):
+        stripe = _stripe()
+        cells = self._cells[stripe]
+        with self._locks[stripe]:
+            cells[bisect.bisect_left(self.buckets, value)] += 1
+            cells[-1] += value
+
+    def snapshot(self):
+        """
+        :return: cumulative bucket counts (last one is +Inf) and the sum of observed values
+        """
+        totals = [sum(cells[i] for cells in self._cells) for i in range(len(self.buckets) + 2)]
+        cumulative = []
+        running = 0
+        for count in totals[:-1]:
+            running += count
+            cumulative.append(running)
+        return cumulative, totals[-1]
+
+
+def _format_labels(labels: Tuple[Tuple[str, str], ...], extra: str = '') -> str:
+    parts = [f'{key}="{value}"' for key, value in labels]
+    if extra:
+        parts.append(extra)
+    return '{' + ','.join(parts) + '}' if parts else ''
+
+
+class MetricsRegistry:
+    """
+    Process-wide metric families, rendered in the Prometheus text exposition format.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._families: Dict[str, Tuple[str, str, dict]] = {}
+
+    def _metric(self, kind: str, factory, name: str, description: str, labels: dict):
+        key = tuple(sorted(labels.items()))
+        family = self._families.get(name)
+        if family is not None:
+            metric = family[2].get(key)
+            if metric is not None:
+                return metric
+        with self._lock:
+            family = self._families.setdefault(name, (kind, description, {}))
+            return family[2].setdefault(key, factory())
+
+    def counter(self, name: str, description: str, **labels) -> Counter:
+        return self._metric('counter', Counter, name, description, labels)
+
+    def gauge(self, name: str, description: str, **labels) -> Gauge:
+        return self._metric('gauge', Gauge, name, description, labels)
+
+    def histogram(self, name: str, description: str, buckets=LATENCY_BUCKETS, **labels) -> Histogram:
+        return self._metric('histogram', lambda: Histogram(buckets), name, description, labels)
+
+    def render(self) -> str:
+        lines = []
+        for name, (kind, description, metrics) in sorted(self._families.items()):
+            lines.append(f'# HELP {name} {description}')
+            lines.append(f'# TYPE {name} {kind}')
+            for labels, metric in sorted(metrics.items()):
+                if kind == 'histogram':
+                    cumulative, total = metric.snapshot()
+                    for bound, count in zip(metric.buckets + ('+Inf',), cumulative):
+                        bucket_label = f'le="{bound}"'
+                        lines.append(f'{name}_bucket{_format_labels(labels, bucket_label)} {count}')
+                    lines.append(f'{name}_sum{_format_labels(labels)} {total}')
+                    lines.append(f'{name}_count{_format_labels(labels)} {cumulative[-1]}')
+                else:
+                    lines.append(f'{name}{_format_labels(labels)} {metric.value}')
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = MetricsRegistry()
+
+
+def start_metrics_server(port: int, registry: MetricsRegistry = REGISTRY) -> ThreadingHTTPServer:
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = registry.render().encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(('0.0.0.0', port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name='metrics-endpoint', daemon=True).start()
+    return server
@@ -0,0 +1,63 @@
+import time
+
+from src.utils.metrics import MetricsRegistry, LATENCY_BUCKETS
+
+
+def message_size(message) -> int:
+    # pre-serialized and raw messages are plain bytes
+    if isinstance(message, bytes):
+        return len(message)
+    return message.ByteSize()
+
+
+class RpcMetrics:
+    """
+    Metrics of one method on one side (`grpc_server_*` or `grpc_client_*`), resolved once so the hot path
+    only touches already created counters.
+    """
+
+    def __init__(self, registry: MetricsRegistry, side: str, method: str):
+        self._registry = registry
+        self._side = side
+        self._method = method
+        self._handled = {}
+        self.latency = registry.histogram(f'grpc_{side}_handling_seconds', 'Duration of RPCs until their status is known',
+                                          LATENCY_BUCKETS, grpc_method=method)
+        self.messages_received = registry.counter(f'grpc_{side}_msg_received_total', 'Messages received',
+                                                  grpc_method=method)
+        self.messages_sent = registry.counter(f'grpc_{side}_msg_sent_total', 'Messages sent', grpc_method=method)
+        self.bytes_received = registry.counter(f'grpc_{side}_received_bytes_total', 'Serialized bytes received',
+                                               grpc_method=method)
+        self.bytes_sent = registry.counter(f'grpc_{side}_sent_bytes_total', 'Serialized bytes sent', grpc_method=method)
+
+    def received(self, message):
+        self.messages_received.inc()
+        self.bytes_received.inc(message_size(message))
+
+    def sent(self, message):
+        self.messages_sent.inc()
+        self.bytes_sent.inc(message_size(message))
+
+    def count_received(self, messages):
+        for message in messages:
+            self.received(message)
+            yield message
+
+    def count_sent(self, messages):
+        for message in messages:
+            self.sent(message)
+            yield message
+
+    async def async_count_received(self, messages):
+        async for message in messages:
+            self.received(message)
+            yield message
+
+    def finish(self, code_name: str, started: float):
+        self.latency.observe(time.perf_counter() - started)
+        counter = self._handled.get(code_name)
+        if counter is None:
+            counter = self._handled[code_name] = self._registry.counter(
+                f'grpc_{self._side}_handled_total', 'Completed RPCs by status code', grpc_method=self._method,
+                grpc_code=code_name)
+        counter.inc()
@@ -0,0 +1,53 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+
+class VerifiedTokenCache:
+    """
+    Bounded LRU of tokens whose signature and claims have already been verified.
+    Entries are keyed by a digest of the raw token and expire with the token's own `exp`,
+    capped by `max_ttl_s` so tokens without `exp` are still re-verified from time to time.
+    """
+
+    def __init__(self, *, max_size: int = 1024, max_ttl_s: float = 300):
+        self._max_size = max_size
+        self._max_ttl_s = max_ttl_s
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _digest(token: str) -> bytes:
+        return hashlib.blake2b(token.encode(), digest_size=16).digest()
+
+    def get(self, token: str):
+        key = self._digest(token)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                not_before, expires_at, payload = entry
+                if not_before <= now < expires_at:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return payload
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, token: str, payload: dict):
+        now = time.time()
+        expires_at = min(payload.get('exp', now + self._max_ttl_s), now + self._max_ttl_s)
+        not_before = payload.get('nbf', now)
+        key = self._digest(token)
+        with self._lock:
+            self._entries[key] = (not_before, expires_at, payload)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_size:
+                self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
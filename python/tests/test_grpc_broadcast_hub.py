@@ -0,0 +1,33 @@
+import itertools
+import time
+
+import social_media_stream_pb2
+
+from src.server.grpc_broadcast_hub import BroadcastHub
+
+
+def _session_frames():
+    sessions = itertools.count()
+
+    def frame_source(provider_name):
+        session = next(sessions)
+        for i in itertools.count():
+            yield social_media_stream_pb2.StreamUpdate(
+                video_frame=social_media_stream_pb2.VideoFrame(frame_data=f'{session}-{i}'.encode())), i == 0
+
+    return frame_source
+
+
+def _frame_data(payload: bytes) -> bytes:
+    return social_media_stream_pb2.StreamUpdate.FromString(payload).video_frame.frame_data
+
+
+def test_viewer_after_last_one_left_starts_a_new_session():
+    hub = BroadcastHub('provider', frame_interval_s=0.001, frame_source=_session_frames())
+    assert [_frame_data(payload) for payload in hub.frames(limit=3)] == [b'0-0', b'0-1', b'0-2']
+    deadline = time.monotonic() + 5
+    while hub._producing():
+        assert time.monotonic() < deadline, 'the producer kept running without viewers'
+        time.sleep(0.01)
+
+    assert [_frame_data(payload) for payload in hub.frames(limit=2)] == [b'1-0', b'1-1']
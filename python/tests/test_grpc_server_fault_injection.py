@@ -0,0 +1,83 @@
+import asyncio
+from concurrent import futures
+
+import grpc
+import pytest
+
+from src.interceptor.grpc_server_fault_injection import AsyncFaultInjectionServerInterceptor, FaultInjector, \
+    FaultInjectionServerInterceptor
+
+ECHO_METHOD = '/Echo/echo'
+MESSAGES = [b'x' * 100] * 5
+# faults that delay messages but must never fail the call
+DELAY_ONLY_CONFIGS = {
+    'latency': {'default': {'latency': {'distribution': 'fixed', 'ms': 1}}},
+    'throttle': {'default': {'bandwidthBytesPerS': 1_000_000}},
+}
+
+
+def _echo(request_iterator, context):
+    yield from request_iterator
+
+
+async def _async_echo(request_iterator, context):
+    async for request in request_iterator:
+        yield request
+
+
+def _echo_handler(behavior):
+    # no (de)serializers, requests and responses stay bytes
+    return grpc.method_handlers_generic_handler('Echo', {'echo': grpc.stream_stream_rpc_method_handler(behavior)})
+
+
+def _call_echo(port: int):
+    with grpc.insecure_channel(f'localhost:{port}') as channel:
+        return list(channel.stream_stream(ECHO_METHOD)(iter(MESSAGES), timeout=5))
+
+
+@pytest.mark.parametrize('config', DELAY_ONLY_CONFIGS.values(), ids=DELAY_ONLY_CONFIGS.keys())
+def test_stream_stream_with_delay_only_faults_completes(config):
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=2),
+                         interceptors=[FaultInjectionServerInterceptor(FaultInjector(config))])
+    server.add_generic_rpc_handlers((_echo_handler(_echo),))
+    port = server.add_insecure_port('localhost:0')
+    server.start()
+    try:
+        assert _call_echo(port) == MESSAGES
+    finally:
+        server.stop(None)
+
+
+@pytest.mark.parametrize('config', DELAY_ONLY_CONFIGS.values(), ids=DELAY_ONLY_CONFIGS.keys())
+def test_async_stream_stream_with_delay_only_faults_completes(config):
+    async def run():
+        server = grpc.aio.server(interceptors=[AsyncFaultInjectionServerInterceptor(FaultInjector(config))])
+        server.add_generic_rpc_handlers((_echo_handler(_async_echo),))
+        port = server.add_insecure_port('localhost:0')
+        await server.start()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(None, _call_echo, port)
+        finally:
+            await server.stop(None)
+
+    assert asyncio.run(run()) == MESSAGES
+
+
+def test_stream_stream_fails_after_messages():
+    config = {'default': {'failAfterMessages': 2, 'failureCodes': ['ABORTED']}}
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=2),
+                         interceptors=[FaultInjectionServerInterceptor(FaultInjector(config))])
+    server.add_generic_rpc_handlers((_echo_handler(_echo),))
+    port = server.add_insecure_port('localhost:0')
+    server.start()
+    try:
+        with grpc.insecure_channel(f'localhost:{port}') as channel:
+            responses = channel.stream_stream(ECHO_METHOD)(iter(MESSAGES), timeout=5)
+            received = []
+            with pytest.raises(grpc.RpcError) as error:
+                for response in responses:
+                    received.append(response)
+        assert len(received) == 2
+        assert error.value.code() == grpc.StatusCode.ABORTED
+    finally:
+        server.stop(None)